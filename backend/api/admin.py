@@ -1,9 +1,4 @@
-from typing import Any
-
 from django.contrib import admin
-from django.db.models import Count
-from django.db.models.query import QuerySet
-from django.http import HttpRequest
 
 from recipes.models import Favorite, Ingredient, Recipe, Tag
 from users.models import User
@@ -15,7 +10,9 @@ class UserAdmin(admin.ModelAdmin):
         'email',
         'first_name',
         'last_name',
-        'avatar'
+        'avatar',
+        'recipes_count',
+        'followers_count'
     )
     list_editable = (
         'email',
@@ -46,18 +43,19 @@ class RecipeAdmin(admin.ModelAdmin):
     inlines = (FavoriteInLine,)
     list_display = (
         'name',
-        'author'
+        'author',
+        'favorites_count'
     )
     search_fields = (
         'name',
         'author'
     )
+    readonly_fields = (
+        'favorites_count',
+        'in_carts_count'
+    )
     # list_filter = ('tags',)
 
-    def get_queryset(self, request: HttpRequest) -> QuerySet[Any]:
-        queryset = super().get_queryset(request)
-        queryset = queryset.annotate(favorited=Count('favorite'))
-
 
 class TagAdmin(admin.ModelAdmin):
     list_display = (
@@ -0,0 +1,113 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseRedirect
+from django.urls import URLResolver
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+from .cache import (cached_data, ingredient_search_params, recipe_list_params,
+                    short_link_key)
+from .metrics import cache_hit
+from .utils import recipe_page_url
+
+# Django 3.2 не умеет асинхронный ORM, а DRF 3.12 - асинхронные вьюхи.
+# Поэтому под ASGI горячие GET-запросы сначала ищутся в кеше в пуле
+# потоков, без подключения к базе и не занимая поток синхронных вьюх
+# (он у воркера один). Промах отдаётся исходной вьюхе DRF.
+
+CONDITIONAL_HEADERS = ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE')
+
+
+def async_fast_path(view, lookup):
+    """
+    Асинхронная обёртка над синхронной вьюхой. lookup(request, **kwargs)
+    обращается только к кешу и возвращает ответ или None.
+    """
+    lookup = sync_to_async(lookup, thread_sensitive=False)
+    sync_view = sync_to_async(view)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        response = await lookup(request, **kwargs)
+        if response is None:
+            response = await sync_view(request, *args, **kwargs)
+        return response
+
+    return wrapper
+
+
+def _plain_get(request, kwargs, anonymous=True):
+    """
+    GET за JSON без условных заголовков, а для anonymous и без токена.
+    ETag, 304, браузерный API и проверку токена делает вьюха DRF.
+    """
+    meta = request.META
+    return (
+        request.method == 'GET'
+        and 'format' not in kwargs and 'format' not in request.GET
+        and 'text/html' not in meta.get('HTTP_ACCEPT', '')
+        and not any(header in meta for header in CONDITIONAL_HEADERS)
+        and not (anonymous and 'HTTP_AUTHORIZATION' in meta)
+    )
+
+
+def _cached_json(request, name, params):
+    data = cached_data(request, name, params)
+    if data is None:
+        return None
+    cache_hit('response', True)
+    response = HttpResponse(
+        JSONRenderer().render(data), content_type='application/json'
+    )
+    patch_vary_headers(response, ['Accept', 'Authorization'])
+    return response
+
+
+def recipe_list(request, **kwargs):
+    if _plain_get(request, kwargs):
+        return _cached_json(
+            request, 'recipe-list', recipe_list_params(request)
+        )
+
+
+def recipe_detail(request, pk, **kwargs):
+    if _plain_get(request, kwargs):
+        return _cached_json(request, 'recipe-detail', {'pk': pk})
+
+
+def ingredient_search(request, **kwargs):
+    """Справочник публичный, токен не влияет на ответ."""
+    if request.GET.get('name') and _plain_get(
+        request, kwargs, anonymous=False
+    ):
+        return _cached_json(
+            request, 'ingredient-search', ingredient_search_params(request)
+        )
+
+
+def short_link(request, short_url):
+    recipe_id = cache.get(short_link_key(short_url))
+    if recipe_id is not None:
+        return HttpResponseRedirect(recipe_page_url(recipe_id))
+
+
+FAST_PATHS = {
+    'recipes-list': recipe_list,
+    'recipes-detail': recipe_detail,
+    'ingredients-list': ingredient_search,
+    'short_link': short_link,
+}
+
+
+def with_fast_paths(patterns):
+    """Подменяет вьюхи из FAST_PATHS во всём дереве маршрутов."""
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            with_fast_paths(pattern.url_patterns)
+        elif pattern.name in FAST_PATHS:
+            pattern.callback = async_fast_path(
+                pattern.callback, FAST_PATHS[pattern.name]
+            )
+    return patterns
@@ -0,0 +1,153 @@
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from .constants import MAX_PAGE_SIZE, PAGE_SIZE, RESPONSE_CACHE_TIMEOUT
+from .metrics import cache_hit
+
+TAG_KEY_PREFIX = 'api:tag:'
+RESPONSE_KEY_PREFIX = 'api:response:'
+SHORT_LINK_KEY_PREFIX = 'api:short-link:'
+INGREDIENTS_TAG = 'ingredients'
+RECIPE_LIST_TAG = 'recipes'
+# Меняется при изменении любого автора, см. RecipeViewSet.get_validators.
+AUTHORS_TAG = 'authors'
+# Меняется при любой инвалидации, см. cached_response.
+ANY_CHANGE_TAG = 'any'
+
+
+def recipe_tag(pk):
+    return f'recipe:{pk}'
+
+
+def author_tag(pk):
+    return f'author:{pk}'
+
+
+def author_list_tag(pk):
+    return f'recipes:author:{pk}'
+
+
+def tag_tag(pk):
+    return f'tag:{pk}'
+
+
+def short_link_key(short_url):
+    return SHORT_LINK_KEY_PREFIX + short_url
+
+
+def _tag_versions(tags):
+    """Текущие версии тегов; отсутствующие в кеше создаются."""
+    keys = {TAG_KEY_PREFIX + tag: tag for tag in tags}
+    versions = {
+        keys[key]: version
+        for key, version in cache.get_many(list(keys)).items()
+    }
+    for key, tag in keys.items():
+        if tag not in versions:
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[tag] = cache.get(key)
+    return versions
+
+
+def tag_versions(*tags):
+    versions = _tag_versions(tags)
+    return tuple(versions[tag] for tag in tags)
+
+
+def invalidate_tags(*tags):
+    """Новая версия тега делает устаревшими все ответы с этим тегом."""
+    cache.set_many(
+        {TAG_KEY_PREFIX + tag: uuid.uuid4().hex
+         for tag in (*tags, ANY_CHANGE_TAG)},
+        None
+    )
+
+
+def recipe_list_params(request):
+    """Параметры списка рецептов, влияющие на ответ анониму."""
+    # GET, а не query_params: вызывается и из api.async_views.
+    params = request.GET
+    limit = params.get('limit', '')
+    limit = min(int(limit), MAX_PAGE_SIZE) if limit.isdigit() else PAGE_SIZE
+    return {
+        'page': params.get('page', '1'),
+        'cursor': params.get('cursor'),
+        'limit': limit,
+        'tags': sorted(set(params.getlist('tags'))),
+        'author': params.get('author', ''),
+    }
+
+
+def ingredient_search_params(request):
+    return {'name': request.GET.get('name', '')}
+
+
+def _response_key(request, name, params):
+    # Ссылки в ответе абсолютные, поэтому схема и хост входят в ключ.
+    raw = repr((request.scheme, request.get_host(), name, sorted(
+        params.items()
+    )))
+    return RESPONSE_KEY_PREFIX + hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _recipe_tags(recipe):
+    return [
+        recipe_tag(recipe['id']), author_tag(recipe['author']['id']),
+        *(tag_tag(tag['id']) for tag in recipe['tags'])
+    ]
+
+
+def recipe_response_tags(data, params=None):
+    """
+    Теги ответа: сами рецепты, их авторы и теги, справочник
+    ингредиентов. Для списка ещё и набор рецептов, из которого он
+    собран: весь или только рецепты автора из фильтра.
+    """
+
+    if params is None:
+        return [INGREDIENTS_TAG, *_recipe_tags(data)]
+    tags = [INGREDIENTS_TAG]
+    if params['author']:
+        tags.append(author_list_tag(params['author']))
+    else:
+        tags.append(RECIPE_LIST_TAG)
+    for recipe in data['results']:
+        tags.extend(_recipe_tags(recipe))
+    return tags
+
+
+def cached_data(request, name, params):
+    """Данные сохранённого ответа, если версии его тегов не менялись."""
+    entry = cache.get(_response_key(request, name, params))
+    if entry is None or _tag_versions(entry['tags']) != entry['tags']:
+        return None
+    return entry['data']
+
+
+def cached_response(request, name, params, build, get_tags):
+    """
+    Отдаёт сохранённый ответ, если версии всех его тегов не менялись,
+    иначе строит его заново через build(). Теги ответа известны только
+    после build(), поэтому если за это время была любая инвалидация,
+    ответ не сохраняется: он мог быть собран из устаревших данных.
+    """
+
+    data = cached_data(request, name, params)
+    cache_hit('response', data is not None)
+    if data is not None:
+        return Response(data)
+    before = _tag_versions([ANY_CHANGE_TAG])
+    response = build()
+    if response.status_code != 200:
+        return response
+    versions = _tag_versions([*get_tags(response.data), ANY_CHANGE_TAG])
+    if versions.pop(ANY_CHANGE_TAG) == before[ANY_CHANGE_TAG]:
+        cache.set(
+            _response_key(request, name, params),
+            {'tags': versions, 'data': response.data},
+            RESPONSE_CACHE_TIMEOUT
+        )
+    return response
@@ -1,2 +1,23 @@
 PAGE_SIZE = 6
 MAX_PAGE_SIZE = 100
+SHOPPING_LIST_CHUNK_SIZE = 500
+INGREDIENT_SEARCH_LIMIT = 50
+# Варианты изображений: имя -> (наибольшая сторона, формат Pillow).
+IMAGE_VARIANTS = {
+    'thumb': (160, 'JPEG'),
+    'card': (480, 'JPEG'),
+    'full': (1280, 'JPEG'),
+    'webp': (1280, 'WEBP'),
+}
+IMAGE_QUALITY = 82
+BASE64_CHUNK_SIZE = 64 * 1024
+# Запасной срок жизни закешированного ответа, секунды.
+RESPONSE_CACHE_TIMEOUT = 10 * 60
+# Срок жизни закешированного count в постраничной выдаче, секунды.
+COUNT_CACHE_TIMEOUT = 60
+# Ниже этой оценки планировщика count считается точно.
+EXACT_COUNT_THRESHOLD = 1000
+# Сколько последних запросов к каждой точке API хранит сводка.
+INSTRUMENTATION_WINDOW = 200
+# Срок жизни соответствия короткой ссылки рецепту в кеше, секунды.
+SHORT_LINK_CACHE_TIMEOUT = 24 * 60 * 60
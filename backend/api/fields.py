@@ -0,0 +1,68 @@
+import binascii
+import re
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from drf_extra_fields.fields import Base64FieldMixin, Base64ImageField
+from PIL import Image
+
+from .constants import BASE64_CHUNK_SIZE
+
+# Как и b64decode, пропускаем переносы строк и прочие символы вне алфавита.
+NOT_BASE64 = re.compile(r'[^A-Za-z0-9+/=]')
+
+
+class DecodedImageFile(TemporaryUploadedFile):
+    """
+    Временный файл с декодированной картинкой. Хранилище переносит его
+    в MEDIA_ROOT, поэтому при сборке мусора файл закрывается через
+    close(), который не падает на уже перенесённом файле.
+    """
+
+    def __del__(self):
+        self.close()
+
+
+class StreamingBase64ImageField(Base64ImageField):
+    """
+    Base64ImageField, который декодирует картинку порциями во временный
+    файл на диске. Файл проверяется Pillow по пути и переносится в
+    MEDIA_ROOT без повторного копирования в память.
+    """
+
+    def to_internal_value(self, base64_data):
+        if not isinstance(base64_data, str) or not base64_data:
+            return super().to_internal_value(base64_data)
+        start = base64_data.find(';base64,')
+        start = 0 if start == -1 else start + len(';base64,')
+        decoded_file = DecodedImageFile(
+            name='image', content_type=None, size=0, charset=None
+        )
+        pending = ''
+        try:
+            for offset in range(start, len(base64_data), BASE64_CHUNK_SIZE):
+                pending += NOT_BASE64.sub(
+                    '', base64_data[offset:offset + BASE64_CHUNK_SIZE]
+                )
+                # Декодируются только целые группы по 4 символа,
+                # остаток переходит в следующую порцию.
+                whole = len(pending) - len(pending) % 4
+                decoded_file.write(binascii.a2b_base64(pending[:whole]))
+                pending = pending[whole:]
+            decoded_file.write(binascii.a2b_base64(pending))
+            decoded_file.flush()
+            with Image.open(decoded_file.temporary_file_path()) as image:
+                image_format = image.format.lower()
+        except (binascii.Error, ValueError, OSError):
+            decoded_file.close()
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        extension = 'jpg' if image_format == 'jpeg' else image_format
+        if extension not in self.ALLOWED_TYPES:
+            decoded_file.close()
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+        decoded_file.size = decoded_file.tell()
+        decoded_file.seek(0)
+        decoded_file.name = f'{uuid.uuid4()}.{extension}'
+        decoded_file.content_type = f'image/{image_format}'
+        return super(Base64FieldMixin, self).to_internal_value(decoded_file)
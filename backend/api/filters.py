@@ -1,27 +1,55 @@
 import django_filters
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.functions import Lower
 
-from django.db.models import Exists, OuterRef
-
+from recipes.catalog import catalog
+from recipes.flags import recipe_ids
 from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart
 
+from .constants import INGREDIENT_SEARCH_LIMIT
+
 
 class IngredientFilter(django_filters.FilterSet):
-    name = django_filters.CharFilter(
-        field_name='name',
-        lookup_expr='icontains'
-    )
+    name = django_filters.CharFilter(method='filter_name')
 
     class Meta:
         model = Ingredient
         fields = ['name']
 
+    def filter_name(self, queryset, name, value):
+        """
+        Поиск по названию без учёта регистра: сначала ингредиенты,
+        начинающиеся с value, затем содержащие его. Начинающиеся
+        читаются сразу по индексу text_pattern_ops на LOWER(name);
+        если их набирается на всю выдачу (обычно при автодополнении
+        по 1-2 буквам), возвращается уже прочитанная выборка. Иначе
+        делается поиск по подстроке по индексу pg_trgm.
+        """
+        value = value.lower()
+        queryset = queryset.annotate(lower_name=Lower('name'))
+        prefixed = queryset.filter(
+            lower_name__startswith=value
+        ).order_by('name')[:INGREDIENT_SEARCH_LIMIT]
+        if len(prefixed) == INGREDIENT_SEARCH_LIMIT:
+            return prefixed
+        return queryset.filter(
+            lower_name__contains=value
+        ).annotate(
+            search_rank=Case(
+                When(lower_name__startswith=value, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField()
+            )
+        ).order_by('search_rank', 'name')[:INGREDIENT_SEARCH_LIMIT]
+
 
 class RecipeFilter(django_filters.FilterSet):
     author = django_filters.NumberFilter(
         field_name='author__id'
     )
-    tags = django_filters.AllValuesMultipleFilter(
-        field_name='tags__slug'
+    tags = django_filters.MultipleChoiceFilter(
+        field_name='tags__slug',
+        choices=lambda: [(tag.slug, tag.name) for tag in catalog.tags()]
     )
     is_favorited = django_filters.NumberFilter(
         method='filter_is_favorited'
@@ -34,30 +62,16 @@ class RecipeFilter(django_filters.FilterSet):
         model = Recipe
         fields = ['author', 'tags', 'is_favorited', 'is_in_shopping_cart']
 
-    def filter_is_favorited(self, queryset, name, value):
-        user = self.request.user
-        if user.is_authenticated and value:
-            queryset = queryset.annotate(
-                is_favorited=Exists(
-                    Favorite.objects.filter(
-                        user=user,
-                        recipe=OuterRef('pk')
-                    )
-                )
+    def _filter_user_recipes(self, queryset, model, value):
+        """Id рецептов пользователя берутся из recipes.flags."""
+        if self.request.user.is_authenticated and value:
+            return queryset.filter(
+                pk__in=recipe_ids(self.request, model)
             )
-            return queryset.filter(is_favorited=True)
         return queryset
 
+    def filter_is_favorited(self, queryset, name, value):
+        return self._filter_user_recipes(queryset, Favorite, value)
+
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
-        if user.is_authenticated and value:
-            queryset = queryset.annotate(
-                is_in_shopping_cart=Exists(
-                    ShoppingCart.objects.filter(
-                        user=user,
-                        recipe=OuterRef('pk')
-                    )
-                )
-            )
-            return queryset.filter(is_in_shopping_cart=True)
-        return queryset
+        return self._filter_user_recipes(queryset, ShoppingCart, value)
@@ -0,0 +1,134 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps, features
+
+from .constants import IMAGE_QUALITY, IMAGE_VARIANTS
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+
+READY_VARIANTS_CACHE_SIZE = 10000
+
+_executor = None
+_executor_lock = threading.Lock()
+_ready_variants = set()
+
+
+def get_executor():
+    """Пул потоков воркера для фоновой обработки изображений."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                thread_name_prefix='images'
+            )
+    return _executor
+
+
+def supported_variants():
+    return [
+        variant for variant, (size, image_format) in IMAGE_VARIANTS.items()
+        if image_format != 'WEBP' or features.check('webp')
+    ]
+
+
+def variant_name(name, variant):
+    stem, _ = os.path.splitext(name)
+    image_format = IMAGE_VARIANTS[variant][1]
+    return f'{stem}_{variant}.{EXTENSIONS[image_format]}'
+
+
+def _to_rgb(image):
+    if image.mode == 'RGB':
+        return image
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def make_variants(storage, name):
+    """Создаёт недостающие уменьшенные копии изображения name."""
+    missing = [
+        variant for variant in supported_variants()
+        if not storage.exists(variant_name(name, variant))
+    ]
+    if not missing:
+        return
+    with storage.open(name) as file:
+        image = _to_rgb(ImageOps.exif_transpose(Image.open(file)))
+    for variant in missing:
+        size, image_format = IMAGE_VARIANTS[variant]
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(
+            buffer, image_format, quality=IMAGE_QUALITY, optimize=True
+        )
+        storage.save_derived(
+            variant_name(name, variant), ContentFile(buffer.getvalue())
+        )
+
+
+def _make_variants_logged(storage, name):
+    try:
+        make_variants(storage, name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', name)
+
+
+def schedule_variants(field_file):
+    """Ставит обработку изображения в пул после фиксации транзакции."""
+    if not field_file:
+        return
+    storage, name = field_file.storage, field_file.name
+    transaction.on_commit(
+        lambda: get_executor().submit(_make_variants_logged, storage, name)
+    )
+
+
+def _variant_ready(storage, name):
+    """Готовые варианты запоминаются, чтобы не проверять диск повторно."""
+    if name in _ready_variants:
+        return True
+    if not storage.exists(name):
+        return False
+    if len(_ready_variants) >= READY_VARIANTS_CACHE_SIZE:
+        _ready_variants.clear()
+    _ready_variants.add(name)
+    return True
+
+
+def image_url(request, field_file, variant='full'):
+    """
+    Абсолютная ссылка на вариант изображения, пока вариант
+    не готов - на оригинал.
+    """
+    if not field_file:
+        return None
+    url = field_file.url
+    if variant in supported_variants():
+        name = variant_name(field_file.name, variant)
+        if _variant_ready(field_file.storage, name):
+            url = field_file.storage.url(name)
+    return request.build_absolute_uri(url)
+
+
+def image_urls(request, field_file):
+    """Ссылки на рецепт в полном размере и его уменьшенные копии."""
+    return {
+        'image': image_url(request, field_file),
+        'image_thumb': image_url(request, field_file, 'thumb'),
+        'image_card': image_url(request, field_file, 'card'),
+    }
@@ -0,0 +1,331 @@
+import json
+import math
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPRedirectHandler, Request, build_opener
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from rest_framework.authtoken.models import Token
+
+from api.utils import generate_short_link
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeShortLink,
+                            ShoppingCart, Tag)
+
+User = get_user_model()
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def percentile(values, share):
+    """Процентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(share * len(ordered)) - 1, 0)]
+
+
+class NoRedirect(HTTPRedirectHandler):
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class RemoteResponse:
+
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.streaming = False
+        match = SERVER_TIMING_QUERIES.search(
+            headers.get('Server-Timing', '')
+        )
+        self.queries = int(match.group(1)) if match else None
+
+
+class RemoteClient:
+    """
+    HTTP-клиент к запущенному серверу с теми методами django.test.Client,
+    которые нужны сценариям. Число запросов к базе берётся из заголовка
+    Server-Timing, сервер отдаёт его только при DEBUG.
+    """
+
+    opener = build_opener(NoRedirect)
+
+    def __init__(self, base_url, headers):
+        self.base_url = base_url.rstrip('/')
+        self.headers = headers
+
+    def request(self, method, path, data=None):
+        if data:
+            path = f'{path}?{urlencode(data, doseq=True)}'
+        request = Request(
+            self.base_url + path, method=method, headers=self.headers
+        )
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return RemoteResponse(response.status, response.headers)
+        except HTTPError as error:
+            error.read()
+            return RemoteResponse(error.code, error.headers)
+
+    def get(self, path, data=None):
+        return self.request('GET', path, data)
+
+    def post(self, path):
+        return self.request('POST', path)
+
+    def delete(self, path):
+        return self.request('DELETE', path)
+
+
+def response_queries(response):
+    request = getattr(response, 'wsgi_request', None)
+    if request is None:
+        return response.queries
+    return request.instrumentation.queries
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет сценарии API внутри процесса (со всеми middleware) '
+        'или, с --url, по HTTP против запущенного сервера и печатает '
+        'p50/p95 времени ответа и число запросов к базе. '
+        'Данные - из generate_data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=50,
+            help='Запросов на сценарий'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Параллельных потоков'
+        )
+        parser.add_argument(
+            '--host', default='localhost',
+            help='Заголовок Host, должен быть в ALLOWED_HOSTS'
+        )
+        parser.add_argument(
+            '--url',
+            help='Адрес запущенного сервера, например http://127.0.0.1:8000'
+        )
+        parser.add_argument(
+            '--scenario', action='append',
+            help='Запустить только эти сценарии'
+        )
+        parser.add_argument(
+            '--output', help='Сохранить результаты в JSON для сравнения'
+        )
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.host = options['host']
+        self.url = options['url']
+        self.recipe_ids = list(Recipe.objects.values_list('pk', flat=True))
+        users = list(User.objects.filter(recipes_count__gt=0)[:50])
+        if not self.recipe_ids or not users:
+            raise CommandError('Нет данных, сначала запустите generate_data.')
+        self.tokens = [
+            Token.objects.get_or_create(user=user)[0].key for user in users
+        ]
+        # Что уже в избранном и корзине у пользователей прогона:
+        # переключение таких рецептов идёт в обратном порядке.
+        self.marked = {
+            path: {
+                token: set(model.objects.filter(user=user).values_list(
+                    'recipe_id', flat=True
+                ))
+                for token, user in zip(self.tokens, users)
+            }
+            for path, model in (
+                ('favorite', Favorite), ('shopping_cart', ShoppingCart)
+            )
+        }
+        self.author_ids = [user.pk for user in users]
+        self.tag_slugs = list(Tag.objects.values_list('slug', flat=True))
+        self.short_urls = [
+            RecipeShortLink.objects.get_or_create(
+                recipe_id=recipe_id,
+                defaults={'short_url': generate_short_link()}
+            )[0].short_url
+            for recipe_id in self.recipe_ids[:50]
+        ]
+        self.ingredient_prefixes = [
+            name[:3] for name in
+            Ingredient.objects.values_list('name', flat=True)[:200]
+        ]
+        scenarios = self.scenarios()
+        if options['scenario']:
+            unknown = set(options['scenario']) - set(scenarios)
+            if unknown:
+                raise CommandError(
+                    f'Неизвестные сценарии: {", ".join(sorted(unknown))}. '
+                    f'Есть: {", ".join(scenarios)}.'
+                )
+            scenarios = {
+                name: scenarios[name] for name in options['scenario']
+            }
+        results = {}
+        for name, scenario in scenarios.items():
+            samples = self.run(
+                scenario, options['iterations'], options['concurrency']
+            )
+            results[name] = self.summarize(samples)
+            self.report(name, results[name])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+
+    def client(self, authenticated):
+        token = self.random.choice(self.tokens) if authenticated else None
+        authorization = token and 'Token ' + token
+        if self.url:
+            headers = {'Authorization': authorization} if token else {}
+            client = RemoteClient(self.url, headers)
+        else:
+            headers = {'HTTP_HOST': self.host}
+            if token:
+                headers['HTTP_AUTHORIZATION'] = authorization
+            client = Client(**headers)
+        client.token = token
+        return client
+
+    def scenarios(self):
+        """Сценарий: (авторизован ли, функция client -> список ответов)."""
+        def recipe():
+            return self.random.choice(self.recipe_ids)
+
+        def page():
+            return self.random.randint(1, 20)
+
+        def toggle(path):
+            """
+            Добавляет и убирает рецепт, а уже отмеченный - наоборот,
+            так что данные после прогона остаются прежними.
+            """
+            def run(client):
+                recipe_id = recipe()
+                url = f'/api/recipes/{recipe_id}/{path}/'
+                if recipe_id in self.marked[path][client.token]:
+                    return [client.delete(url), client.post(url)]
+                return [client.post(url), client.delete(url)]
+            return run
+
+        return {
+            'recipes_anon': (False, lambda client: [
+                client.get(f'/api/recipes/?page={page()}')
+            ]),
+            'recipes_auth': (True, lambda client: [
+                client.get(f'/api/recipes/?page={page()}')
+            ]),
+            'recipes_tags': (True, lambda client: [client.get(
+                '/api/recipes/',
+                {'tags': self.random.sample(self.tag_slugs, 2)}
+            )]),
+            'recipes_author': (True, lambda client: [client.get(
+                f'/api/recipes/?author={self.random.choice(self.author_ids)}'
+            )]),
+            'recipes_favorited': (True, lambda client: [
+                client.get('/api/recipes/?is_favorited=1')
+            ]),
+            'recipes_in_cart': (True, lambda client: [
+                client.get('/api/recipes/?is_in_shopping_cart=1')
+            ]),
+            'recipes_cursor': (True, lambda client: [
+                client.get('/api/recipes/?cursor=')
+            ]),
+            'recipe_anon': (False, lambda client: [
+                client.get(f'/api/recipes/{recipe()}/')
+            ]),
+            'recipe_auth': (True, lambda client: [
+                client.get(f'/api/recipes/{recipe()}/')
+            ]),
+            'ingredient_search': (True, lambda client: [client.get(
+                '/api/ingredients/',
+                {'name': self.random.choice(self.ingredient_prefixes)}
+            )]),
+            'short_link': (False, lambda client: [
+                client.get(f'/s/{self.random.choice(self.short_urls)}/')
+            ]),
+            'subscriptions': (True, lambda client: [
+                client.get('/api/users/subscriptions/?recipes_limit=3')
+            ]),
+            'favorite_toggle': (True, toggle('favorite')),
+            'cart_toggle': (True, toggle('shopping_cart')),
+            'download_shopping_cart': (True, lambda client: [
+                client.get('/api/recipes/download_shopping_cart/')
+            ]),
+        }
+
+    def run(self, scenario, iterations, concurrency):
+        authenticated, make_requests = scenario
+
+        def one(_):
+            client = self.client(authenticated)
+            started = time.perf_counter()
+            responses = make_requests(client)
+            for response in responses:
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+            queries = [response_queries(response) for response in responses]
+            queries = None if None in queries else sum(queries)
+            errors = sum(response.status_code >= 400 for response in responses)
+            return elapsed * 1000 / len(responses), queries, errors
+
+        def worker(chunk):
+            try:
+                return [one(index) for index in chunk]
+            finally:
+                connections.close_all()
+
+        if concurrency == 1:
+            return [one(index) for index in range(iterations)]
+        chunks = [range(index, iterations, concurrency)
+                  for index in range(concurrency)]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return [
+                sample for samples in executor.map(worker, chunks)
+                for sample in samples
+            ]
+
+    @staticmethod
+    def summarize(samples):
+        times = [sample[0] for sample in samples]
+        queries = [sample[1] for sample in samples if sample[1] is not None]
+        return {
+            'requests': len(samples),
+            'errors': sum(sample[2] for sample in samples),
+            'p50_ms': round(percentile(times, 0.5), 2),
+            'p95_ms': round(percentile(times, 0.95), 2),
+            'max_ms': round(max(times), 2),
+            'queries_avg': (
+                round(sum(queries) / len(queries), 2) if queries else None
+            ),
+            'queries_max': max(queries, default=None),
+        }
+
+    def report(self, name, result):
+        line = (
+            f'{name:24} n={result["requests"]:<5} '
+            f'p50={result["p50_ms"]:>8.2f} мс  '
+            f'p95={result["p95_ms"]:>8.2f} мс'
+        )
+        if result['queries_avg'] is not None:
+            line += (
+                f'  запросов к базе: {result["queries_avg"]:.1f} '
+                f'(макс. {result["queries_max"]})'
+            )
+        if result['errors']:
+            self.stdout.write(self.style.WARNING(
+                f'{line}  ошибок: {result["errors"]}'
+            ))
+        else:
+            self.stdout.write(line)
@@ -0,0 +1,77 @@
+import os
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from api.constants import IMAGE_VARIANTS
+from api.images import variant_name
+from recipes.models import Recipe
+from recipes.storage import image_storage
+
+User = get_user_model()
+
+IMAGES_DIR = 'api/images'
+
+
+def walk_files(storage, directory):
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield os.path.join(directory, name)
+    for subdirectory in directories:
+        yield from walk_files(storage, os.path.join(directory, subdirectory))
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет картинки и их уменьшенные копии, на которые не ссылается '
+        'ни один рецепт и ни один аватар.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=60,
+            help=('Не трогать файлы моложе стольких минут: они могут '
+                  'принадлежать ещё не сохранённому запросу')
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено'
+        )
+
+    def handle(self, *args, **options):
+        references = {}
+        for name in Recipe.objects.values_list('image', flat=True):
+            references[name] = references.get(name, 0) + 1
+        for name in User.objects.exclude(avatar__isnull=True).values_list(
+            'avatar', flat=True
+        ):
+            references[name] = references.get(name, 0) + 1
+        keep = set()
+        for name in references:
+            if name:
+                keep.add(name)
+                keep.update(variant_name(name, variant)
+                            for variant in IMAGE_VARIANTS)
+        if not image_storage.exists(IMAGES_DIR):
+            return
+        deadline = time.time() - options['min_age'] * 60
+        removed = 0
+        freed = 0
+        for name in walk_files(image_storage, IMAGES_DIR):
+            if name in keep:
+                continue
+            path = image_storage.path(name)
+            if os.path.getmtime(path) > deadline:
+                continue
+            freed += os.path.getsize(path)
+            removed += 1
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                image_storage.delete(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Ссылок на картинки: {sum(references.values())}, '
+            f'уникальных файлов: {len(keep & references.keys())}. '
+            f'Удалено файлов без ссылок: {removed} ({freed // 1024} КБ).'
+        ))
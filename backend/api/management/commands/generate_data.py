@@ -0,0 +1,174 @@
+import io
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from PIL import Image
+
+from api.cache import RECIPE_LIST_TAG, invalidate_tags
+from api.images import make_variants
+from recipes.constants import MAX_INGREDIENT_AMOUNT
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.storage import image_storage
+from users.models import Follow
+
+User = get_user_model()
+
+DEFAULT_INGREDIENTS = settings.BASE_DIR.parent / 'data' / 'ingredients.json'
+TAGS = (('Завтрак', 'breakfast'), ('Обед', 'lunch'), ('Ужин', 'dinner'))
+PASSWORD = 'synthetic-password'
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт синтетические данные для нагрузочных тестов: '
+        'пользователей, рецепты с 5-30 ингредиентами, теги, подписки, '
+        'избранное и списки покупок. Пароль пользователей - '
+        f'{PASSWORD}.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument(
+            '--follows', type=int, default=10,
+            help='Подписок на пользователя'
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Рецептов в избранном и в списке покупок у пользователя'
+        )
+        parser.add_argument(
+            '--ingredients', default=str(DEFAULT_INGREDIENTS),
+            help='Файл для load_ingredients, если ингредиентов ещё нет'
+        )
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['recipes'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь и рецепт.')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+        if not Ingredient.objects.exists():
+            call_command(
+                'load_ingredients', options['ingredients'],
+                stdout=self.stdout
+            )
+        ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+        tag_ids = [
+            Tag.objects.get_or_create(slug=slug, defaults={'name': name})[0].pk
+            for name, slug in TAGS
+        ]
+        image = self.save_image()
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            recipes = self.create_recipes(
+                options['recipes'], users, image, ingredient_ids, tag_ids
+            )
+            self.create_relations(users, recipes, options)
+            call_command('recount_counters', stdout=self.stdout)
+        # bulk_create не шлёт сигналов, кеш ответов сбрасывается вручную.
+        invalidate_tags(RECIPE_LIST_TAG)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пользователей: {len(users)}, рецептов: {len(recipes)}, '
+            f'{time.monotonic() - started:.1f} с.'
+        ))
+
+    def bulk_create(self, model, objects, **kwargs):
+        return model.objects.bulk_create(
+            objects, batch_size=self.batch_size, **kwargs
+        )
+
+    def save_image(self):
+        """Одна картинка на все рецепты: хранилище адресует по хешу."""
+        buffer = io.BytesIO()
+        Image.new('RGB', (1280, 960), (200, 120, 60)).save(buffer, 'JPEG')
+        name = image_storage.save(
+            'api/images/synthetic.jpg', ContentFile(buffer.getvalue())
+        )
+        make_variants(image_storage, name)
+        return name
+
+    def create_users(self, count):
+        offset = User.objects.count()
+        password = make_password(PASSWORD)
+        users = self.bulk_create(User, [
+            User(
+                username=f'synthetic{offset + index}',
+                email=f'synthetic{offset + index}@example.com',
+                first_name='Имя', last_name='Фамилия', password=password
+            )
+            for index in range(count)
+        ])
+        if connection.features.can_return_rows_from_bulk_insert:
+            return users
+        return list(User.objects.filter(
+            username__in=[user.username for user in users]
+        ))
+
+    def create_recipes(self, count, users, image, ingredient_ids, tag_ids):
+        last_pk = Recipe.objects.aggregate(pk=Max('pk'))['pk'] or 0
+        recipes = self.bulk_create(Recipe, [
+            Recipe(
+                author=self.random.choice(users),
+                name=f'Рецепт {index}', image=image,
+                text='Синтетический рецепт для нагрузочного теста.',
+                cooking_time=self.random.randint(5, 180)
+            )
+            for index in range(count)
+        ])
+        if not connection.features.can_return_rows_from_bulk_insert:
+            # Без RETURNING (SQLite) id новых рецептов читаются заново.
+            recipes = list(Recipe.objects.filter(pk__gt=last_pk))
+        self.bulk_create(IngredientRecipe, [
+            IngredientRecipe(
+                recipe=recipe, ingredient_id=ingredient_id,
+                amount=self.random.randint(1, MAX_INGREDIENT_AMOUNT)
+            )
+            for recipe in recipes
+            for ingredient_id in self.random.sample(
+                ingredient_ids,
+                min(self.random.randint(5, 30), len(ingredient_ids))
+            )
+        ])
+        through = Recipe.tags.through
+        self.bulk_create(through, [
+            through(recipe_id=recipe.pk, tag_id=tag_id)
+            for recipe in recipes
+            for tag_id in self.random.sample(
+                tag_ids, self.random.randint(1, len(tag_ids))
+            )
+        ])
+        return recipes
+
+    def create_relations(self, users, recipes, options):
+        follows, favorites, carts = [], [], []
+        for user in users:
+            for author in self.random.sample(
+                users, min(options['follows'], len(users))
+            ):
+                if author != user:
+                    follows.append(Follow(user=user, author=author))
+            size = min(options['favorites'], len(recipes))
+            favorites.extend(
+                Favorite(user=user, recipe=recipe)
+                for recipe in self.random.sample(recipes, size)
+            )
+            carts.extend(
+                ShoppingCart(user=user, recipe=recipe)
+                for recipe in self.random.sample(recipes, size)
+            )
+        self.bulk_create(Follow, follows, ignore_conflicts=True)
+        self.bulk_create(Favorite, favorites, ignore_conflicts=True)
+        self.bulk_create(ShoppingCart, carts, ignore_conflicts=True)
@@ -0,0 +1,51 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from api.images import make_variants
+from recipes.models import Recipe
+from recipes.storage import image_storage
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт недостающие уменьшенные копии картинок рецептов '
+        'и аватаров пользователей.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Число потоков обработки'
+        )
+
+    def handle(self, *args, **options):
+        names = set(
+            Recipe.objects.exclude(image='').values_list('image', flat=True)
+        ) | set(
+            User.objects.exclude(avatar='').exclude(
+                avatar__isnull=True
+            ).values_list('avatar', flat=True)
+        )
+        started = time.monotonic()
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {
+                executor.submit(make_variants, image_storage, name): name
+                for name in names
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{futures[future]}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {len(names) - failed}, '
+            f'с ошибками: {failed}, {time.monotonic() - started:.1f} с.'
+        ))
@@ -0,0 +1,68 @@
+import os
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+# Метрики собираются в каждом воркере gunicorn. С переменной
+# окружения PROMETHEUS_MULTIPROC_DIR воркеры пишут их в общий
+# каталог, а выдача складывает значения всех воркеров.
+
+REQUESTS = Counter(
+    'foodgram_requests_total', 'Запросы к API.',
+    ['route', 'method', 'status']
+)
+REQUEST_LATENCY = Histogram(
+    'foodgram_request_duration_seconds', 'Время обработки запроса.',
+    ['route', 'method']
+)
+DB_QUERIES = Histogram(
+    'foodgram_db_queries', 'Запросов к базе на один запрос к API.',
+    ['route', 'method'],
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, float('inf'))
+)
+DB_TIME = Histogram(
+    'foodgram_db_duration_seconds', 'Время запросов к базе.',
+    ['route', 'method']
+)
+CACHE_REQUESTS = Counter(
+    'foodgram_cache_requests_total', 'Обращения к кешам API.',
+    ['cache', 'result']
+)
+SHOPPING_LIST_BYTES = Histogram(
+    'foodgram_shopping_list_bytes', 'Размер выгрузки списка покупок.',
+    ['format'],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, float('inf'))
+)
+
+
+def observe_request(route, method, status, duration, queries, db_time):
+    REQUESTS.labels(route, method, status).inc()
+    REQUEST_LATENCY.labels(route, method).observe(duration)
+    DB_QUERIES.labels(route, method).observe(queries)
+    DB_TIME.labels(route, method).observe(db_time)
+
+
+def cache_hit(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def measure_export(chunks, export_format):
+    """Пропускает поток выгрузки, считая его размер в байтах."""
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk.encode() if isinstance(chunk, str) else chunk)
+            yield chunk
+    finally:
+        SHOPPING_LIST_BYTES.labels(export_format).observe(size)
+
+
+def exposition():
+    """Метрики в текстовом формате Prometheus и их content type."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
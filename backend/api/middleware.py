@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject, empty
+
+from .constants import INSTRUMENTATION_WINDOW
+from .metrics import observe_request
+
+logger = logging.getLogger(__name__)
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+# Счётчик текущего запроса. Контекст переходит в потоки sync_to_async,
+# так что под ASGI учитываются и запросы из потока синхронных вьюх.
+_current_stats = ContextVar('request_stats', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """В строгом режиме (тесты) роняет запрос сверх бюджета."""
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.render_time = 0.0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Обёртка execute_wrapper, которая стоит на каждом подключении
+    (см. api.signals) и передаёт запрос счётчику текущего запроса.
+    """
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+@contextmanager
+def measure_serialization():
+    """
+    Засекает время сериализации текущего запроса. Вложенные вызовы
+    не считаются повторно; запросы к базе изнутри сериализаторов
+    (ленивые связи) входят и в это время.
+    """
+    stats = _current_stats.get()
+    if stats is None or stats.serializing:
+        yield
+        return
+    stats.serializing = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serialize_time += time.perf_counter() - start
+        stats.serializing = False
+
+
+def _is_staff(request):
+    """Ленивый пользователь сессии не вычисляется ради заголовка."""
+    user = getattr(request, 'user', None)
+    if user is None or (
+        isinstance(user, SimpleLazyObject) and user._wrapped is empty
+    ):
+        return False
+    return user.is_staff
+
+
+def _endpoint(request):
+    match = request.resolver_match
+    if match is None:
+        return None, None
+    view_class = getattr(match.func, 'cls', None)
+    actions = getattr(match.func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{request.method} {match.view_name}', (view_class, action)
+
+
+def _query_budget(view):
+    """
+    Бюджет из атрибута query_budget вьюхи: число на все действия
+    или словарь {действие: число}.
+    """
+    view_class, action = view
+    budget = getattr(view_class, 'query_budget', None)
+    if isinstance(budget, dict):
+        return budget.get(action)
+    return budget
+
+
+def _record(endpoint, sample):
+    with _endpoints_lock:
+        samples = _endpoints.get(endpoint)
+        if samples is None:
+            samples = _endpoints[endpoint] = deque(
+                maxlen=INSTRUMENTATION_WINDOW
+            )
+        samples.append(sample)
+
+
+def endpoint_summary():
+    """
+    Сводка по последним INSTRUMENTATION_WINDOW запросам каждой точки:
+    среднее и максимум запросов к базе, времени (мс) и размера ответа.
+    """
+    with _endpoints_lock:
+        snapshot = {key: list(samples) for key, samples in _endpoints.items()}
+    summary = {}
+    for endpoint, samples in sorted(snapshot.items()):
+        summary[endpoint] = {'requests': len(samples)}
+        for field in samples[0]:
+            values = [sample[field] for sample in samples]
+            summary[endpoint][field] = {
+                'avg': round(sum(values) / len(values), 2),
+                'max': max(values),
+            }
+    return summary
+
+
+class InstrumentationMiddleware:
+    """
+    Считает для каждого запроса число запросов к базе и их время,
+    время сериализации и рендеринга ответа и его размер. Пишет их в заголовок
+    Server-Timing (при DEBUG и для персонала, кроме потоковых ответов),
+    в скользящую сводку endpoint_summary() и в метрики Prometheus
+    (api.metrics), сверяет число запросов с query_budget вьюхи.
+    У потоковых ответов учитывается и перебор тела. Работает и под WSGI,
+    и под ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Под ASGI Django ждёт от middleware корутину.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stats, token = self.start(request)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats, start)
+
+    async def __acall__(self, request):
+        stats, token = self.start(request)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats, start)
+
+    @staticmethod
+    def start(request):
+        stats = request.instrumentation = RequestStats()
+        return stats, _current_stats.set(stats)
+
+    def finish(self, request, response, stats, start):
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, request, response, stats, start
+            )
+            return response
+        self.account(request, response, stats, start)
+        return response
+
+    def stream(self, content, request, response, stats, start):
+        """
+        Тело потокового ответа читается уже после выхода из middleware,
+        и запросы к базе идут при его переборе. Они засчитываются тому
+        же запросу, а учёт закрывается после последней порции (или при
+        обрыве передачи).
+        """
+        token = _current_stats.set(stats)
+        size = 0
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            _current_stats.reset(token)
+            self.account(request, response, stats, start, size)
+
+    def account(self, request, response, stats, start, size=None):
+        total = time.perf_counter() - start
+        endpoint, view = _endpoint(request)
+        match = request.resolver_match
+        observe_request(
+            match.view_name if match else 'unmatched', request.method,
+            response.status_code, total, stats.queries, stats.db_time
+        )
+        if endpoint is None:
+            return
+        if size is None:
+            size = len(response.content)
+        _record(endpoint, {
+            'queries': stats.queries,
+            'db_ms': round(stats.db_time * 1000, 2),
+            'serialize_ms': round(stats.serialize_time * 1000, 2),
+            'render_ms': round(stats.render_time * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+            'size': size,
+        })
+        # Заголовки потокового ответа уже отправлены, и неполных
+        # цифр в Server-Timing для него лучше не давать.
+        if not response.streaming and (
+            settings.DEBUG or _is_staff(request)
+        ):
+            response['Server-Timing'] = (
+                f'db;dur={stats.db_time * 1000:.1f};'
+                f'desc="{stats.queries} queries", '
+                f'serialize;dur={stats.serialize_time * 1000:.1f}, '
+                f'render;dur={stats.render_time * 1000:.1f}, '
+                f'total;dur={total * 1000:.1f}'
+            )
+        self.check_budget(endpoint, view, stats.queries)
+
+    def process_template_response(self, request, response):
+        """Ответы DRF рендерятся после этого хука, засекаем время."""
+        start = time.perf_counter()
+
+        def rendered(response):
+            request.instrumentation.render_time = time.perf_counter() - start
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def check_budget(endpoint, view, queries):
+        budget = _query_budget(view)
+        if budget is None or queries <= budget:
+            return
+        message = (
+            f'{endpoint}: {queries} запросов к базе при бюджете {budget}'
+        )
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
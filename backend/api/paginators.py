@@ -1,9 +1,171 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+import json
+from functools import partial
 
-from .constants import MAX_PAGE_SIZE, PAGE_SIZE
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+from .constants import (COUNT_CACHE_TIMEOUT, EXACT_COUNT_THRESHOLD,
+                        MAX_PAGE_SIZE, PAGE_SIZE)
+from .metrics import cache_hit
+
+
+def exact_count(queryset):
+    return queryset.count()
+
+
+def cached_count(queryset):
+    """Точный count, закешированный по тексту запроса на короткий срок."""
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        # Фильтр вида pk__in=[]: выборка заведомо пуста.
+        return 0
+    key = 'api:count:' + hashlib.sha1(
+        repr((queryset.db, sql, params)).encode()
+    ).hexdigest()
+    count = cache.get(key)
+    cache_hit('count', count is not None)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def estimated_count(queryset):
+    """
+    Оценка планировщика PostgreSQL из EXPLAIN. Небольшие выборки
+    считаются точно, на других базах - cached_count.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return cached_count(queryset)
+    try:
+        sql, params = (
+            queryset.order_by().values('pk').query.sql_with_params()
+        )
+    except EmptyResultSet:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    estimate = int(plan[0]['Plan']['Plan Rows'])
+    if estimate < EXACT_COUNT_THRESHOLD:
+        return queryset.count()
+    return estimate
+
+
+COUNT_STRATEGIES = {
+    'exact': exact_count,
+    'cached': cached_count,
+    'estimate': estimated_count,
+}
+
+
+class LookaheadPage(Page):
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class CountStrategyPaginator(Paginator):
+    """
+    С приблизительным count (cached, estimate) граница выборки
+    определяется не по нему, а по лишней записи сверх страницы:
+    иначе при заниженной оценке последние страницы отдавали бы 404,
+    а при завышенной появлялись бы пустые. count в ответе
+    поправляется по тому, что было прочитано.
+    """
+
+    def __init__(self, *args, count_function=exact_count, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_function = count_function
+
+    @cached_property
+    def count(self):
+        return self.count_function(self.object_list)
+
+    def page(self, number):
+        if self.count_function is exact_count:
+            return super().page(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(_('That page contains no results'))
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        seen = bottom + len(rows)
+        if not has_next:
+            self.count = seen
+        elif self.count <= seen:
+            self.count = seen + 1
+        return LookaheadPage(rows, number, self, has_next)
 
 
 class PageLimitPagination(PageNumberPagination):
+    """
+    Способ подсчёта count берётся из атрибута count_strategy вьюхи,
+    по умолчанию - из настройки PAGINATION_COUNT_STRATEGY.
+    """
+
     page_size = PAGE_SIZE
     page_size_query_param = 'limit'
     max_page_size = MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        strategy = getattr(
+            view, 'count_strategy', settings.PAGINATION_COUNT_STRATEGY
+        )
+        self.django_paginator_class = partial(
+            CountStrategyPaginator, count_function=COUNT_STRATEGIES[strategy]
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+
+class CursorLimitPagination(CursorPagination):
+    page_size = PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+    ordering = '-id'
+
+
+class FeedPagination(PageLimitPagination):
+    """
+    По умолчанию - page/limit, как ждёт фронтенд. С параметром cursor
+    (первая страница - с пустым) - выборка по ключу -id без OFFSET и
+    без подсчёта общего числа записей.
+    """
+
+    cursor_pagination = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_param = CursorLimitPagination.cursor_query_param
+        if cursor_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        self.cursor_pagination = CursorLimitPagination()
+        return self.cursor_pagination.paginate_queryset(
+            queryset, request, view
+        )
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is None:
+            return super().get_paginated_response(data)
+        return self.cursor_pagination.get_paginated_response(data)
@@ -1,28 +1,46 @@
+from collections import Counter
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import transaction
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
+from recipes.catalog import catalog
 from recipes.constants import (
     MAX_COOCING_TIME,
     MAX_INGREDIENT_AMOUNT,
     MIN_COOCING_TIME,
     MIN_INGREDIENT_AMOUNT
 )
+from recipes.flags import recipe_ids
 from recipes.models import (Favorite, Ingredient, IngredientRecipe,
                             Recipe, ShoppingCart, Tag)
 from users.models import Follow
 
+from .fields import StreamingBase64ImageField
+from .images import image_url, image_urls
+from .middleware import measure_serialization
+from .utils import get_recipes_limit
+
 
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+class TimedSerializerMixin:
+    """Время to_representation попадает в Server-Timing (serialize)."""
+
+    def to_representation(self, instance):
+        with measure_serialization():
+            return super().to_representation(instance)
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор пользователя."""
 
     is_subscribed = serializers.SerializerMethodField()
-    avatar = Base64ImageField(required=False, allow_null=True)
+    avatar = StreamingBase64ImageField(required=False, allow_null=True)
     password = serializers.CharField(
         write_only=True, required=True,
         validators=[validate_password]
@@ -35,6 +53,9 @@ class UserSerializer(serializers.ModelSerializer):
             'last_name', 'avatar', 'is_subscribed', 'password')
 
     def get_is_subscribed(self, obj):
+        annotated = getattr(obj, 'is_subscribed', None)
+        if annotated is not None:
+            return annotated
         request = self.context.get('request')
         if request is None:
             return False
@@ -53,12 +74,10 @@ class UserSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request is None:
             representation['avatar'] = None
-        elif instance.avatar and hasattr(instance.avatar, 'url'):
-            representation['avatar'] = request.build_absolute_uri(
-                instance.avatar.url
-            )
         else:
-            representation['avatar'] = None
+            representation['avatar'] = image_url(
+                request, instance.avatar, 'card'
+            )
         return representation
 
     def validate(self, attrs):
@@ -87,7 +106,7 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор тегов.
     Создавать новые теги может только администратор.
@@ -98,7 +117,7 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'slug')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор ингредиентов.
     Создавать новые ингредиенты может только администратор.
@@ -109,13 +128,11 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
-class IngrdientRecipeSerializer(serializers.ModelSerializer):
+class IngrdientRecipeSerializer(TimedSerializerMixin,
+                                serializers.ModelSerializer):
     """Сериализатор для связывающей модели рецепт-ингредиент."""
 
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-        source='ingredient'
-    )
+    id = serializers.ReadOnlyField(source='ingredient.id')
     name = serializers.CharField(
         source='ingredient.name',
         read_only=True)
@@ -139,7 +156,47 @@ class IngrdientRecipeSerializer(serializers.ModelSerializer):
         fields = ('amount', 'id', 'measurement_unit', 'name')
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeFlagsMixin:
+    """
+    Признаки is_favorited и is_in_shopping_cart: проверка вхождения
+    в закешированные множества id рецептов пользователя.
+    """
+
+    def _get_user_flag(self, obj, model):
+        request = self.context.get('request')
+        if request is None:
+            return False
+        return obj.pk in recipe_ids(request, model)
+
+    def get_is_favorited(self, obj):
+        return self._get_user_flag(obj, Favorite)
+
+    def get_is_in_shopping_cart(self, obj):
+        return self._get_user_flag(obj, ShoppingCart)
+
+
+class IngredientAmountSerializer(TimedSerializerMixin, serializers.Serializer):
+    """
+    Ингредиент рецепта при создании и редактировании.
+    Существование id проверяется сразу для всего списка в
+    RecipeCreateUpdateSerializer.validate_ingredients.
+    """
+
+    id = serializers.IntegerField()
+    amount = serializers.IntegerField(
+        validators=[
+            MinValueValidator(
+                MIN_INGREDIENT_AMOUNT,
+                message=f'Ингредиентов - не менее {MIN_INGREDIENT_AMOUNT}!'),
+            MaxValueValidator(
+                MAX_INGREDIENT_AMOUNT,
+                message=f'Ингредиентов - не более {MAX_INGREDIENT_AMOUNT}!')
+        ]
+    )
+
+
+class RecipeReadSerializer(RecipeFlagsMixin, TimedSerializerMixin,
+                           serializers.ModelSerializer):
     """Сериализатор для чтения рецепта."""
 
     author = UserSerializer(read_only=True)
@@ -160,35 +217,34 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             'is_favorited', 'is_in_shopping_cart'
         )
 
-    def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Favorite.objects.filter(
-                user=request.user, recipe=obj
-            ).exists()
-        return False
+    def to_representation(self, instance):
+        author_is_subscribed = getattr(instance, 'author_is_subscribed', None)
+        if author_is_subscribed is not None:
+            instance.author.is_subscribed = author_is_subscribed
+        representation = super().to_representation(instance)
+        representation.update(
+            image_urls(self.context.get('request'), instance.image)
+        )
+        return representation
 
-    def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return ShoppingCart.objects.filter(
-                user=request.user, recipe=obj
-            ).exists()
-        return False
+
+class RecipeShortSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Краткий сериализатор рецепта для подписок, избранного и покупок."""
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'name', 'image', 'cooking_time')
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        request = self.context.get('request')
-        if instance.image and hasattr(instance.image, 'url'):
-            representation['image'] = request.build_absolute_uri(
-                instance.image.url
-            )
-        else:
-            representation['image'] = None
+        representation.update(
+            image_urls(self.context.get('request'), instance.image)
+        )
         return representation
 
 
-class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
+class RecipeCreateUpdateSerializer(TimedSerializerMixin,
+                                   serializers.ModelSerializer):
     """
     Сериализатор для создания, редактирования и удаления рецептов.
     Создать рецепт можно только с использованием
@@ -196,88 +252,62 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     """
 
     author = UserSerializer(read_only=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Tag.objects.all()
-    )
-    ingredients = IngrdientRecipeSerializer(
+    tags = serializers.ListField(child=serializers.IntegerField())
+    ingredients = IngredientAmountSerializer(
         source='ingredientrecipe_set', many=True,
     )
-    image = Base64ImageField(required=False, allow_null=True)
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+    image = StreamingBase64ImageField(required=False, allow_null=True)
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'author', 'name', 'image', 'text',
-            'ingredients', 'tags', 'cooking_time',
-            'is_favorited', 'is_in_shopping_cart'
+            'ingredients', 'tags', 'cooking_time'
         )
 
-    def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Favorite.objects.filter(
-                user=request.user, recipe=obj
-            ).exists()
-        return False
-
-    def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return ShoppingCart.objects.filter(
-                user=request.user, recipe=obj
-            ).exists()
-        return False
+    @staticmethod
+    def _check_ids(ids, found, name):
+        """Собирает все повторы и несуществующие id в одну ошибку."""
+        errors = []
+        missing = sorted(set(ids) - found.keys())
+        if missing:
+            errors.append(
+                f'Указаны несуществующие {name}: '
+                f'{", ".join(map(str, missing))}.'
+            )
+        repeated = sorted(
+            pk for pk, count in Counter(ids).items() if count > 1
+        )
+        if repeated:
+            errors.append(
+                f'{name.capitalize()} не должны повторяться: '
+                f'{", ".join(map(str, repeated))}.'
+            )
+        if errors:
+            raise serializers.ValidationError(errors)
 
     def validate_ingredients(self, ingredients):
         if not ingredients:
             raise serializers.ValidationError(
                 'Поле "ингредиенты" обязательно.'
             )
-        ingredient_ids = []
-        for ingredient in ingredients:
-            ingredient_id = ingredient['ingredient'].id
-            if not ingredient:
-                raise serializers.ValidationError(
-                    'Отсутствует поле "id" для ингредиента.'
-                )
-            if 'amount' not in ingredient:
-                raise serializers.ValidationError(
-                    'Отсутствует поле "amount" для ингредиента.'
-                )
-            if not Ingredient.objects.filter(
-                id=ingredient_id
-            ).exists():
-                raise serializers.ValidationError(
-                    'Указан несуществующий ингредиент.'
-                )
-            if ingredient_id in ingredient_ids:
-                raise serializers.ValidationError(
-                    'Ингредиенты не должны повторяться.'
-                )
-            ingredient_ids.append(ingredient_id)
-        return ingredients
+        ids = [ingredient['id'] for ingredient in ingredients]
+        found = catalog.ingredients_by_ids(ids)
+        self._check_ids(ids, found, 'ингредиенты')
+        return [
+            {'ingredient': found[ingredient['id']],
+             'amount': ingredient['amount']}
+            for ingredient in ingredients
+        ]
 
     def validate_tags(self, tags):
         if not tags:
             raise serializers.ValidationError(
                 'Поле "теги" обязательно.'
             )
-        tag_ids = []
-        for tag in tags:
-            if not Tag.objects.filter(
-                id=tag.id
-            ).exists():
-                raise serializers.ValidationError(
-                    'Указан несуществующий тег.'
-                )
-            if tag.id in tag_ids:
-                raise serializers.ValidationError(
-                    'Теги не должны повторяться.'
-                )
-            tag_ids.append(tag.id)
-        return tags
+        found = catalog.tags_by_ids(tags)
+        self._check_ids(tags, found, 'теги')
+        return [found[pk] for pk in tags]
 
     def validate_cooking_time(self, cooking_time):
         if int(cooking_time) < MIN_COOCING_TIME:
@@ -321,6 +351,40 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             ))
         IngredientRecipe.objects.bulk_create(ingredient_recipe_bounds)
 
+    def update_ingredient_recipe(self, ingredients_data, recipe):
+        """
+        Сравнивает новые ингредиенты с сохранёнными: удаляет убранные,
+        обновляет изменившиеся количества и добавляет только новые.
+        Сохранённые читаются заново внутри транзакции update(), после
+        блокировки рецепта, а не из prefetch вьюхи: иначе два
+        одновременных PATCH добавили бы один ингредиент дважды.
+        """
+        amounts = {
+            ingredient_data['ingredient'].id: ingredient_data['amount']
+            for ingredient_data in ingredients_data
+        }
+        existing = {
+            bound.ingredient_id: bound
+            for bound in IngredientRecipe.objects.filter(recipe=recipe)
+        }
+        removed_ids = []
+        changed = []
+        for ingredient_id, bound in existing.items():
+            if ingredient_id not in amounts:
+                removed_ids.append(bound.id)
+            elif bound.amount != amounts[ingredient_id]:
+                bound.amount = amounts[ingredient_id]
+                changed.append(bound)
+        if removed_ids:
+            IngredientRecipe.objects.filter(id__in=removed_ids).delete()
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ['amount'])
+        self.create_ingredient_recipe([
+            ingredient_data for ingredient_data in ingredients_data
+            if ingredient_data['ingredient'].id not in existing
+        ], recipe)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredientrecipe_set')
         tags_data = validated_data.pop('tags')
@@ -329,11 +393,14 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         recipe.tags.set(tags_data)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         if self.context.get('request').user != instance.author:
             raise serializers.ValidationError(
                 'Пользователь не может редактировать чужие рецепты.'
             )
+        # Одновременные изменения рецепта выполняются по очереди.
+        Recipe.objects.select_for_update().only('pk').get(pk=instance.pk)
         ingredients_data = validated_data.pop('ingredientrecipe_set')
         tags_data = validated_data.pop('tags')
         instance.name = validated_data.get('name', instance.name)
@@ -343,26 +410,18 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             'cooking_time', instance.cooking_time
         )
         instance.save()
-        instance.ingredients.clear()
-        self.create_ingredient_recipe(ingredients_data, instance)
+        self.update_ingredient_recipe(ingredients_data, instance)
         instance.tags.set(tags_data)
         return instance
 
     def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        request = self.context.get('request')
-        if instance.image and hasattr(instance.image, 'url'):
-            representation['image'] = request.build_absolute_uri(
-                instance.image.url
-            )
-        else:
-            representation['image'] = None
-        representation['tags'] = TagSerializer(
-            instance.tags.all(), many=True).data
-        return representation
+        user = self.context.get('request').user
+        instance = Recipe.objects.with_related(user).get(pk=instance.pk)
+        return RecipeReadSerializer(instance, context=self.context).data
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
     """Сериализатор для списка избранного."""
 
     id = serializers.IntegerField(source='author.id', read_only=True)
@@ -391,35 +450,27 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         return True
 
     def get_avatar(self, obj):
-        request = self.context.get('request')
-        if obj.author.avatar and hasattr(obj.author.avatar, 'url'):
-            return request.build_absolute_uri(obj.author.avatar.url)
-        return None
+        return image_url(
+            self.context.get('request'), obj.author.avatar, 'card'
+        )
 
     def get_recipes(self, obj):
-        limit = self.context.get(
-            'request'
-        ).query_params.get('recipes_limit')
-        recipes = obj.author.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
-        recipes_data = RecipeReadSerializer(
+        recipes = getattr(obj.author, 'limited_recipes', None)
+        if recipes is None:
+            recipes = obj.author.recipes.order_by('-id')
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit is not None:
+                recipes = recipes[:limit]
+        return RecipeShortSerializer(
             recipes, many=True, context=self.context
         ).data
-        for recipe_data in recipes_data:
-            recipe_data.pop('author', None)
-            recipe_data.pop('text', None)
-            recipe_data.pop('ingredients', None)
-            recipe_data.pop('tags', None)
-            recipe_data.pop('is_favorited', None)
-            recipe_data.pop('is_in_shopping_cart', None)
-        return recipes_data
 
     def get_recipes_count(self, obj):
-        return obj.author.recipes.count()
+        return obj.author.recipes_count
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class ShoppingCartSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
     """Сериализатор списка покупок."""
 
     user = serializers.PrimaryKeyRelatedField(
@@ -442,21 +493,17 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
             )
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         return ShoppingCart.objects.create(**validated_data)
 
     def to_representation(self, instance):
-        recipe = instance.recipe
-        request = self.context.get('request')
-        image_url = request.build_absolute_uri(recipe.image.url)
-        return {
-            'id': recipe.id,
-            'name': recipe.name,
-            'image': image_url,
-            'cooking_time': recipe.cooking_time}
+        return RecipeShortSerializer(
+            instance.recipe, context=self.context
+        ).data
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор избранного."""
 
     user = serializers.PrimaryKeyRelatedField(
@@ -480,21 +527,17 @@ class FavoriteSerializer(serializers.ModelSerializer):
             )
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         return Favorite.objects.create(**validated_data)
 
     def to_representation(self, instance):
-        recipe = instance.recipe
-        request = self.context.get('request')
-        image_url = request.build_absolute_uri(recipe.image.url)
-        return {
-            'id': recipe.id,
-            'name': recipe.name,
-            'image': image_url,
-            'cooking_time': recipe.cooking_time}
+        return RecipeShortSerializer(
+            instance.recipe, context=self.context
+        ).data
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор подписок."""
 
     user = serializers.PrimaryKeyRelatedField(
@@ -522,5 +565,6 @@ class FollowSerializer(serializers.ModelSerializer):
             )
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         return Follow.objects.create(**validated_data)
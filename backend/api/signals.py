@@ -0,0 +1,83 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.catalog import catalog_changed
+from recipes.models import Recipe, RecipeShortLink, Tag
+
+from .cache import (AUTHORS_TAG, INGREDIENTS_TAG, RECIPE_LIST_TAG,
+                    author_list_tag, author_tag, invalidate_tags, recipe_tag,
+                    short_link_key, tag_tag)
+from .images import schedule_variants
+from .middleware import count_queries
+
+User = get_user_model()
+
+# Поля пользователя, которых нет в ответах API.
+HIDDEN_USER_FIELDS = {'last_login', 'password'}
+
+
+def invalidate_on_commit(*tags):
+    transaction.on_commit(lambda: invalidate_tags(*tags))
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_variants(instance.image)
+
+
+@receiver(post_save, sender=User)
+def process_avatar(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and 'avatar' not in update_fields):
+        return
+    schedule_variants(instance.avatar)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe(sender, instance, **kwargs):
+    invalidate_on_commit(
+        recipe_tag(instance.pk), RECIPE_LIST_TAG,
+        author_list_tag(instance.author_id)
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(sender, instance, action, **kwargs):
+    if action.startswith('post_') and isinstance(instance, Recipe):
+        invalidate_recipe(Recipe, instance)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag(sender, instance, **kwargs):
+    invalidate_on_commit(tag_tag(instance.pk))
+
+
+@receiver(catalog_changed)
+def invalidate_ingredients(sender, **kwargs):
+    # Справочник сам вызывает invalidate() после коммита.
+    invalidate_tags(INGREDIENTS_TAG)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= HIDDEN_USER_FIELDS:
+        return
+    invalidate_on_commit(author_tag(instance.pk), AUTHORS_TAG)
+
+
+@receiver(post_delete, sender=RecipeShortLink)
+def forget_short_link(sender, instance, **kwargs):
+    cache.delete(short_link_key(instance.short_url))
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    # Сигнал приходит и при переподключении того же DatabaseWrapper.
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
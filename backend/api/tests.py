@@ -0,0 +1,401 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.catalog import catalog
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag)
+from users.models import User
+
+from .constants import INGREDIENT_SEARCH_LIMIT
+from .middleware import _endpoints, endpoint_summary
+
+RECIPES = 30
+
+
+class RecipeDataTestCase(TestCase):
+    """Три автора, тридцать рецептов; self.client - с токеном автора."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{index}', email=f'author{index}@example.com',
+                first_name='Имя', last_name='Фамилия', password='password'
+            )
+            for index in range(3)
+        ]
+        cls.user = cls.authors[0]
+        cls.token = Token.objects.create(user=cls.user)
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {index}', measurement_unit='г'
+            )
+            for index in range(10)
+        ]
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {index}', slug=f'tag{index}')
+            for index in range(2)
+        ]
+        cls.recipes = []
+        for index in range(RECIPES):
+            recipe = Recipe.objects.create(
+                author=cls.authors[index % len(cls.authors)],
+                name=f'Рецепт {index}', text='Текст', cooking_time=10,
+                image='api/images/test.jpg'
+            )
+            recipe.tags.set(cls.tags)
+            IngredientRecipe.objects.bulk_create([
+                IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=index + 1
+                )
+                for ingredient in cls.ingredients[:5]
+            ])
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryCountTests(RecipeDataTestCase):
+    """
+    Число запросов к базе на точку API. Кеши очищаются перед каждым
+    запросом, так что считаются промахи; справочник в памяти процесса
+    прогрет. С QUERY_BUDGET_STRICT превышение query_budget вьюхи
+    тоже роняет тест.
+    """
+
+    def reset_caches(self, warm_catalog=True):
+        cache.clear()
+        if warm_catalog:
+            catalog.ingredients()
+
+    def assertQueries(self, number, client, url, warm_catalog=True):
+        self.reset_caches(warm_catalog)
+        with self.assertNumQueries(number):
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_recipe_list_anonymous(self):
+        self.assertQueries(4, self.anonymous, '/api/recipes/?limit=6')
+        self.assertQueries(4, self.anonymous, '/api/recipes/?limit=24')
+
+    def test_recipe_list_authenticated(self):
+        self.assertQueries(7, self.client, '/api/recipes/?limit=6')
+        self.assertQueries(7, self.client, '/api/recipes/?limit=24')
+
+    def test_recipe_detail_anonymous(self):
+        self.assertQueries(
+            4, self.anonymous, f'/api/recipes/{self.recipes[0].pk}/'
+        )
+
+    def test_recipe_detail_authenticated(self):
+        self.assertQueries(
+            7, self.client, f'/api/recipes/{self.recipes[0].pk}/'
+        )
+
+    def test_ingredient_search(self):
+        Ingredient.objects.bulk_create([
+            Ingredient(name=f'соль {index}', measurement_unit='г')
+            for index in range(INGREDIENT_SEARCH_LIMIT)
+        ])
+        prefix = '/api/ingredients/?name=сол'
+        substring = '/api/ingredients/?name=диент'
+        for warm_catalog in (True, False):
+            with self.subTest(warm_catalog=warm_catalog):
+                self.assertQueries(1, self.anonymous, prefix, warm_catalog)
+                self.assertQueries(2, self.client, prefix, warm_catalog)
+                self.assertQueries(
+                    2, self.anonymous, substring, warm_catalog
+                )
+                self.assertQueries(3, self.client, substring, warm_catalog)
+
+    def test_cached_recipe_list_anonymous(self):
+        self.reset_caches()
+        self.anonymous.get('/api/recipes/')
+        with self.assertNumQueries(0):
+            self.anonymous.get('/api/recipes/')
+
+    def test_download_shopping_cart(self):
+        url = '/api/recipes/download_shopping_cart/'
+        for recipe in self.recipes[:5]:
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        self.assertQueries(2, self.client, url)
+        for recipe in self.recipes[5:25]:
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        self.assertQueries(2, self.client, url)
+
+
+class PaginationTests(RecipeDataTestCase):
+    """Список рецептов с приблизительным count (count_strategy)."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_last_page_by_lookahead(self):
+        response = self.anonymous.get('/api/recipes/?limit=6&page=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], RECIPES)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(len(response.data['results']), 6)
+        response = self.anonymous.get('/api/recipes/?limit=6&page=6')
+        self.assertEqual(response.status_code, 404)
+
+    def test_empty_flag_filter_last_page(self):
+        for flag in ('is_favorited', 'is_in_shopping_cart'):
+            with self.subTest(flag=flag):
+                response = self.client.get(
+                    f'/api/recipes/?{flag}=1&page=last'
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data['count'], 0)
+                self.assertEqual(response.data['results'], [])
+
+
+class ShoppingListExportTests(RecipeDataTestCase):
+
+    url = '/api/recipes/download_shopping_cart/'
+
+    def test_formats(self):
+        for export_format, media_type in (
+            ('txt', 'text/plain'), ('csv', 'text/csv'),
+            ('json', 'application/json')
+        ):
+            with self.subTest(export_format=export_format):
+                response = self.client.get(
+                    self.url, {'format': export_format}
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response['Content-Type'].startswith(
+                    media_type
+                ))
+
+    def test_unknown_format(self):
+        response = self.client.get(self.url, {'format': 'xml'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('txt, csv, json', response.json()['detail'])
+
+    def test_errors_are_json(self):
+        response = self.anonymous.get(self.url, {'format': 'csv'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+@override_settings(DEBUG=True)
+class InstrumentationTests(RecipeDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        _endpoints.clear()
+
+    def test_streaming_queries_are_counted(self):
+        for recipe in self.recipes[:5]:
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        body = b''.join(response.streaming_content)
+        summary = endpoint_summary()['GET api:recipes-get']
+        self.assertEqual(summary['requests'], 1)
+        self.assertEqual(summary['queries']['max'], 2)
+        self.assertEqual(summary['size']['max'], len(body))
+        self.assertNotIn('Server-Timing', response)
+
+
+class CounterTests(RecipeDataTestCase):
+    """Счётчики избранного и корзины в Recipe (recipes.counters)."""
+
+    def assertCounters(self, recipe, favorites, in_carts):
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, favorites)
+        self.assertEqual(recipe.in_carts_count, in_carts)
+
+    def test_favorite_and_cart(self):
+        recipe = self.recipes[0]
+        url = f'/api/recipes/{recipe.pk}'
+        self.assertEqual(self.client.post(f'{url}/favorite/').status_code, 201)
+        self.assertCounters(recipe, 1, 0)
+        self.assertEqual(
+            self.client.post(f'{url}/shopping_cart/').status_code, 201
+        )
+        self.assertCounters(recipe, 1, 1)
+        self.assertEqual(
+            self.client.delete(f'{url}/favorite/').status_code, 204
+        )
+        self.assertCounters(recipe, 0, 1)
+        self.assertEqual(
+            self.client.delete(f'{url}/shopping_cart/').status_code, 204
+        )
+        self.assertCounters(recipe, 0, 0)
+
+    def test_full_save_keeps_counters(self):
+        recipe = Recipe.objects.get(pk=self.recipes[0].pk)
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        recipe.name = 'Новое название'
+        recipe.save()
+        self.assertCounters(recipe, 1, 1)
+        self.assertEqual(recipe.name, 'Новое название')
+        author = User.objects.get(pk=self.user.pk)
+        Recipe.objects.create(
+            author=author, name='Ещё рецепт', text='Текст', cooking_time=5,
+            image='api/images/test.jpg'
+        )
+        author.first_name = 'Другое'
+        author.save()
+        author.refresh_from_db()
+        self.assertEqual(
+            author.recipes_count, RECIPES // len(self.authors) + 1
+        )
+
+    def test_recount_repairs_drift(self):
+        recipe = self.recipes[0]
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        Recipe.objects.update(favorites_count=5, in_carts_count=3)
+        User.objects.update(recipes_count=0)
+        call_command('recount_counters', stdout=StringIO())
+        self.assertCounters(recipe, 1, 0)
+        self.assertCounters(self.recipes[1], 0, 0)
+        self.assertEqual(
+            set(User.objects.values_list('recipes_count', flat=True)),
+            {RECIPES // len(self.authors)}
+        )
+
+
+class CommittedRecipeTestCase(TransactionTestCase):
+    """
+    Кеш ответов и ETag списков меняются по версиям тегов после
+    коммита (transaction.on_commit), поэтому здесь TransactionTestCase.
+    """
+
+    def setUp(self):
+        patcher = mock.patch('api.signals.schedule_variants')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        self.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Текст',
+            cooking_time=10, image='api/images/test.jpg'
+        )
+        self.recipe.tags.set([self.tag])
+        IngredientRecipe.objects.create(
+            recipe=self.recipe, amount=1,
+            ingredient=Ingredient.objects.create(
+                name='соль', measurement_unit='г'
+            )
+        )
+        self.anonymous = APIClient()
+        self.list_url = '/api/recipes/'
+        self.detail_url = f'/api/recipes/{self.recipe.pk}/'
+
+
+class ResponseCacheTests(CommittedRecipeTestCase):
+
+    def get_cached(self, url, queries=0):
+        """
+        Второй запрос отдаётся из кеша; у карточки остаётся запрос
+        дат изменения для ETag.
+        """
+        self.anonymous.get(url)
+        with self.assertNumQueries(queries):
+            return self.anonymous.get(url).data
+
+    def test_recipe_change(self):
+        self.get_cached(self.list_url)
+        self.get_cached(self.detail_url, queries=1)
+        self.recipe.name = 'Новое название'
+        self.recipe.save()
+        response = self.anonymous.get(self.list_url)
+        self.assertEqual(response.data['results'][0]['name'], self.recipe.name)
+        response = self.anonymous.get(self.detail_url)
+        self.assertEqual(response.data['name'], self.recipe.name)
+
+    def test_new_recipe(self):
+        self.assertEqual(self.get_cached(self.list_url)['count'], 1)
+        Recipe.objects.create(
+            author=self.author, name='Второй', text='Текст',
+            cooking_time=5, image='api/images/test.jpg'
+        )
+        self.assertEqual(self.anonymous.get(self.list_url).data['count'], 2)
+
+    def test_tag_change(self):
+        self.get_cached(self.detail_url, queries=1)
+        self.tag.name = 'Обед'
+        self.tag.save()
+        response = self.anonymous.get(self.detail_url)
+        self.assertEqual(response.data['tags'][0]['name'], 'Обед')
+
+    def test_author_change(self):
+        self.get_cached(self.list_url)
+        self.author.first_name = 'Другое'
+        self.author.save()
+        response = self.anonymous.get(self.list_url)
+        self.assertEqual(
+            response.data['results'][0]['author']['first_name'], 'Другое'
+        )
+
+
+class ConditionalGetTests(CommittedRecipeTestCase):
+
+    def assertNotModified(self, url, client=None):
+        """Отдаёт ETag, по которому повторный запрос получил 304."""
+        client = client or self.anonymous
+        etag = client.get(url)['ETag']
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        return etag
+
+    def assertModified(self, url, etag, client=None):
+        client = client or self.anonymous
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_recipe_list(self):
+        etag = self.assertNotModified(self.list_url)
+        self.recipe.name = 'Новое название'
+        self.recipe.save()
+        self.assertModified(self.list_url, etag)
+
+    def test_recipe_list_author_change(self):
+        etag = self.assertNotModified(self.list_url)
+        self.author.first_name = 'Другое'
+        self.author.save()
+        self.assertModified(self.list_url, etag)
+
+    def test_recipe_detail(self):
+        etag = self.assertNotModified(self.detail_url)
+        self.recipe.cooking_time = 20
+        self.recipe.save()
+        self.assertModified(self.detail_url, etag)
+
+    def test_tags(self):
+        etag = self.assertNotModified('/api/tags/')
+        self.tag.name = 'Обед'
+        self.tag.save()
+        self.assertModified('/api/tags/', etag)
+
+    def test_me(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        etag = self.assertNotModified('/api/users/me/', client)
+        self.author.last_name = 'Другая'
+        self.author.save()
+        self.assertModified('/api/users/me/', etag, client)
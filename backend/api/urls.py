@@ -2,8 +2,8 @@ from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
 from .views import (AddAndDeleteAvatar, GetRecipeShortLink,
-                    IngredientViewSet, RecipeViewSet, SubscibeAndDescribe,
-                    TagViewSet, UserViewSet)
+                    IngredientViewSet, Metrics, RecipeViewSet,
+                    SubscibeAndDescribe, TagViewSet, UserViewSet)
 
 
 app_name = 'api'
@@ -25,5 +25,6 @@ urlpatterns = [
          SubscibeAndDescribe.as_view(),
          name='subscribe_and_describe'),
     path('users/me/avatar/', AddAndDeleteAvatar.as_view(),
-         name='add_and_delete_avatar')
+         name='add_and_delete_avatar'),
+    path('metrics/', Metrics.as_view(), name='metrics')
 ]
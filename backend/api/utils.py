@@ -1,8 +1,13 @@
+import csv
 import io
+import json
 import random
 import string
 
-from recipes.models import IngredientRecipe
+from django.db.models import OuterRef, Prefetch, Subquery, Sum
+
+from recipes.models import IngredientRecipe, Recipe
+from users.models import Follow
 
 
 def generate_short_link():
@@ -10,35 +15,94 @@ def generate_short_link():
     return ''.join(random.choice(characters) for _ in range(6))
 
 
-def generate_file(carts):
-    groceries = []
-    for grocery in carts:
-        recipe = grocery.recipe
-        items = IngredientRecipe.objects.filter(recipe=recipe)
-        for item in items:
-            groceries.append([
-                item.ingredient.name,
-                item.amount,
-                item.ingredient.measurement_unit
-            ])
-    final_grocieries = {}
-    grocieries_names = []
+def recipe_page_url(recipe_id):
+    """Адрес рецепта во фронтенде."""
+    return f'/recipes/{recipe_id}'
+
+
+def get_recipes_limit(request):
+    limit = request.query_params.get('recipes_limit')
+    if limit and limit.isdigit():
+        return int(limit)
+    return None
+
+
+def get_subscriptions(user, recipes_limit=None):
+    """
+    Подписки пользователя с авторами.
+    Последние recipes_limit рецептов всех авторов страницы
+    подгружаются одним запросом в author.limited_recipes.
+    """
+    recipes = Recipe.objects.order_by('-id')
+    if recipes_limit is not None:
+        recipes = recipes.filter(pk__in=Subquery(
+            Recipe.objects.filter(
+                author=OuterRef('author')
+            ).order_by('-id').values('pk')[:recipes_limit]
+        ))
+    return Follow.objects.filter(user=user).select_related(
+        'author'
+    ).prefetch_related(
+        Prefetch('author__recipes', queryset=recipes,
+                 to_attr='limited_recipes')
+    ).order_by('-id')
+
+
+def get_shopping_list(user):
+    """
+    Суммирует ингредиенты из списка покупок пользователя.
+    Все рецепты корзины агрегируются одним запросом к базе.
+    """
+    return IngredientRecipe.objects.filter(
+        recipe__shoppingcart__user=user
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).annotate(
+        total_amount=Sum('amount')
+    ).order_by('ingredient__name', 'ingredient__measurement_unit')
+
+
+def _grocery_fields(grocery):
+    return (
+        grocery['ingredient__name'],
+        grocery['total_amount'],
+        grocery['ingredient__measurement_unit']
+    )
+
+
+def stream_txt(groceries):
     for grocery in groceries:
-        if grocery[0] not in grocieries_names:
-            grocieries_names.append(grocery[0])
-            final_grocieries.update(
-                {grocery[0]: [grocery[1], grocery[2]]}
-            )
-        else:
-            final_grocieries[grocery[0]][0] += grocery[1]
-    final_grocieries = sorted(final_grocieries.items())
-    grocieries_to_print = ''
-    for grocery in final_grocieries:
-        am = grocery[1][0]
-        mu = grocery[1][1]
-        grocieries_to_print += f'{grocery[0]} - {am} {mu}\n'
-
-    file_buffer = io.StringIO()
-    file_buffer.write(grocieries_to_print)
-    file_buffer.seek(0)
-    return file_buffer
+        name, amount, unit = _grocery_fields(grocery)
+        yield f'{name} - {amount} {unit}\n'
+
+
+def stream_csv(groceries):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('name', 'amount', 'measurement_unit'))
+    for grocery in groceries:
+        writer.writerow(_grocery_fields(grocery))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_json(groceries):
+    yield '['
+    separator = ''
+    for grocery in groceries:
+        name, amount, unit = _grocery_fields(grocery)
+        yield separator + json.dumps(
+            {'name': name, 'amount': amount, 'measurement_unit': unit},
+            ensure_ascii=False
+        )
+        separator = ','
+    yield ']'
+
+
+SHOPPING_LIST_EXPORTERS = {
+    'txt': stream_txt,
+    'csv': stream_csv,
+    'json': stream_json,
+}
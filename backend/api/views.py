@@ -1,40 +1,122 @@
+import hashlib
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
 from django.shortcuts import get_object_or_404
-from django.http import Http404, HttpResponse
+from django.http import (Http404, HttpResponse, HttpResponseRedirect,
+                         StreamingHttpResponse)
+from django.urls import reverse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
 from djoser.views import UserViewSet as DjoserUserViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import (AllowAny,
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import (AllowAny, IsAdminUser,
                                         IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from recipes.catalog import catalog
+from recipes.flags import versions as flag_versions
 from recipes.models import (
     Favorite, Ingredient, Recipe,
     RecipeShortLink, ShoppingCart, Tag)
 from users.models import Follow
 
+from .cache import (AUTHORS_TAG, INGREDIENTS_TAG, RECIPE_LIST_TAG,
+                    cached_response, ingredient_search_params,
+                    recipe_list_params, recipe_response_tags, short_link_key,
+                    tag_versions)
+from .constants import SHOPPING_LIST_CHUNK_SIZE, SHORT_LINK_CACHE_TIMEOUT
 from .filters import IngredientFilter, RecipeFilter
-from .paginators import PageLimitPagination
+from .metrics import exposition, measure_export
+from .paginators import FeedPagination, PageLimitPagination
 from .permissions import (IsAuthor)
+from .renderers import CSVRenderer, PlainTextRenderer
 from .serializers import (
     FavoriteSerializer, FollowSerializer, IngredientSerializer,
     RecipeCreateUpdateSerializer, RecipeReadSerializer,
     ShoppingCartSerializer, SubscriptionSerializer,
     TagSerializer, UserSerializer)
-from .utils import generate_file, generate_short_link
+from .utils import (SHOPPING_LIST_EXPORTERS, generate_short_link,
+                    get_recipes_limit, get_shopping_list, get_subscriptions,
+                    recipe_page_url)
 
 
 User = get_user_model()
 
 
-class UserViewSet(DjoserUserViewSet):
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы для list и retrieve. Валидаторы из
+    get_validators() считаются до сериализации; если они совпадают
+    с If-None-Match или If-Modified-Since, отдаётся 304 без тела.
+    """
+
+    def conditional_response(self, request, build):
+        validators = self.get_validators()
+        if validators is None:
+            return build()
+        etag_source, last_modified = validators
+        etag = quote_etag(
+            hashlib.md5(repr(etag_source).encode()).hexdigest()
+        )
+        timestamp = last_modified and int(last_modified.timestamp())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=timestamp
+        )
+        if response is None:
+            response = build()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = etag
+        if timestamp:
+            response['Last-Modified'] = http_date(timestamp)
+        patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ['Authorization'])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request,
+            lambda: super(ConditionalGetMixin, self).list(
+                request, *args, **kwargs
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request,
+            lambda: super(ConditionalGetMixin, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
+
+class UserViewSet(ConditionalGetMixin, DjoserUserViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     pagination_class = PageLimitPagination
+    count_strategy = 'estimate'
+    query_budget = {'list': 4, 'retrieve': 3, 'me': 2, 'subscriptions': 5}
+
+    def get_queryset(self):
+        """Подписка на каждого пользователя аннотируется одним Exists."""
+        queryset = super().get_queryset()
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+        return queryset.annotate(is_subscribed=Exists(
+            Follow.objects.filter(user=user, author=OuterRef('pk'))
+        ))
 
     def get_serializer_context(self):
         """Используется для передачи данных о пользователе."""
@@ -47,19 +129,26 @@ class UserViewSet(DjoserUserViewSet):
         detail=False, methods=['get'],
         permission_classes=[IsAuthenticated])
     def me(self, request):
-        return Response(UserSerializer(
-            request.user, context={'request': request}).data)
+        return self.conditional_response(request, lambda: Response(
+            UserSerializer(request.user, context={'request': request}).data
+        ))
+
+    def get_validators(self):
+        if self.action != 'me':
+            return None
+        user = self.request.user
+        return (user.pk, user.updated_at), user.updated_at
 
     @action(
         detail=False, methods=['get'],
         permission_classes=[IsAuthenticated]
     )
     def subscriptions(self, request):
-        follows = Follow.objects.filter(
-            user=self.request.user
-        ).select_related('author')
-        paginator = self.pagination_class()
-        page = paginator.paginate_queryset(follows, request)
+        follows = get_subscriptions(
+            request.user, get_recipes_limit(request)
+        )
+        paginator = FeedPagination()
+        page = paginator.paginate_queryset(follows, request, view=self)
         serializer = SubscriptionSerializer(
             page, many=True, context={'request': request}
         )
@@ -80,11 +169,61 @@ class AddAndDeleteAvatar(APIView):
             serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request):
-        request.user.avatar.delete()
+        """
+        Файл аватара может быть общим с другими записями,
+        его удалит команда collect_orphan_images.
+        """
+
+        request.user.avatar = None
+        request.user.save(update_fields=['avatar', 'updated_at'])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class CatalogViewSetMixin:
+    """
+    Отдаёт справочник из памяти процесса (recipes.catalog) без запросов
+    к базе. catalog_list и catalog_get задаются в наследниках.
+    """
+
+    def use_catalog(self):
+        return True
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_catalog():
+            return self.database_list(request, *args, **kwargs)
+        serializer = self.get_serializer(self.catalog_list(), many=True)
+        return Response(serializer.data)
+
+    def get_object(self):
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        obj = self.catalog_get(int(pk)) if str(pk).isdigit() else None
+        if obj is None:
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    def get_validators(self):
+        """
+        Список валидируется по состоянию всего справочника в памяти,
+        Last-Modified отдаётся только для отдельной записи: по
+        максимальной дате изменения не видно удалений.
+        """
+        if self.action == 'list':
+            items = self.catalog_list()
+            return (
+                len(items),
+                max((item.updated_at for item in items), default=None),
+                sorted(self.request.query_params.lists())
+            ), None
+        obj = self.get_object()
+        return (obj.pk, obj.updated_at), obj.updated_at
+
+    def database_list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+
+class IngredientViewSet(ConditionalGetMixin, CatalogViewSetMixin,
+                        viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     search_fields = ['name']
@@ -92,24 +231,122 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_class = IngredientFilter
     http_method_names = ('get', 'list')
+    # Токен и два запроса поиска: по префиксу и, если его мало, по подстроке.
+    query_budget = 3
+    catalog_get = staticmethod(catalog.get_ingredient)
+    catalog_list = staticmethod(catalog.ingredients)
+
+    def use_catalog(self):
+        """Поиск по названию идёт через индексированный запрос к базе."""
+        return not self.request.query_params.get('name')
+
+    def get_validators(self):
+        """
+        Результат поиска зависит только от версии справочника, так что
+        сам справочник для ETag не загружается.
+        """
+        if self.action == 'list' and not self.use_catalog():
+            return (
+                catalog.version(), sorted(self.request.query_params.lists())
+            ), None
+        return super().get_validators()
+
+    def database_list(self, request, *args, **kwargs):
+        """Результаты поиска кешируются до изменения справочника."""
+        return cached_response(
+            request, 'ingredient-search', ingredient_search_params(request),
+            lambda: super(IngredientViewSet, self).database_list(
+                request, *args, **kwargs
+            ),
+            lambda data: [INGREDIENTS_TAG]
+        )
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ConditionalGetMixin, CatalogViewSetMixin,
+                 viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [AllowAny]
     http_method_names = ('get', 'list')
+    query_budget = 2
+    catalog_get = staticmethod(catalog.get_tag)
+    catalog_list = staticmethod(catalog.tags)
+
+
+class RecipeCacheMixin:
+    """Анонимам list и retrieve отдаются из кеша, см. api.cache."""
+
+    def list(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+        params = recipe_list_params(request)
+        return cached_response(
+            request, 'recipe-list', params,
+            lambda: super(RecipeCacheMixin, self).list(
+                request, *args, **kwargs
+            ),
+            lambda data: recipe_response_tags(data, params)
+        )
 
+    def retrieve(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().retrieve(request, *args, **kwargs)
+        return cached_response(
+            request, 'recipe-detail', {'pk': self.kwargs['pk']},
+            lambda: super(RecipeCacheMixin, self).retrieve(
+                request, *args, **kwargs
+            ),
+            recipe_response_tags
+        )
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(ConditionalGetMixin, RecipeCacheMixin,
+                    viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     http_method_names = ['get', 'patch', 'post', 'delete']
     serializer_class = RecipeReadSerializer
-    pagination_class = PageLimitPagination
+    pagination_class = FeedPagination
+    count_strategy = 'estimate'
+    # Со справочником и наборами флагов, загружаемыми при холодном кеше.
+    query_budget = {'list': 10, 'retrieve': 7, 'get': 2}
     permission_classes = [IsAuthenticatedOrReadOnly]
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        user = self.request.user
+        return Recipe.objects.with_related(user)
+
+    def get_validators(self):
+        """
+        ETag рецептов. Для списка - версии набора рецептов и всех
+        авторов из api.cache (меняются при любом изменении и удалении)
+        и параметры запроса: без запросов к базе, чтобы попадание в кеш
+        ответов оставалось бесплатным. Для рецепта - даты изменения его
+        и автора. Плюс версия справочника тегов и ингредиентов и версии
+        избранного, корзины и подписок пользователя. Last-Modified не
+        отдаётся: он не учитывает ни удалений, ни состояния пользователя.
+        """
+        if self.action == 'list':
+            state = (
+                *tag_versions(RECIPE_LIST_TAG, AUTHORS_TAG),
+                sorted(self.request.query_params.lists())
+            )
+        elif self.action == 'retrieve' and self.kwargs['pk'].isdigit():
+            state = Recipe.objects.filter(pk=self.kwargs['pk']).values_list(
+                'updated_at', 'author__updated_at'
+            ).first()
+            if state is None:
+                return None
+        else:
+            return None
+        user = self.request.user
+        if user.is_authenticated:
+            state = (*state, user.pk, *flag_versions(
+                user.pk, (Favorite, ShoppingCart, Follow)
+            ))
+        return (*state, catalog.version()), None
+
     def get_serializer_class(self):
         if self.request.method == 'POST' or self.request.method == 'PATCH':
             return RecipeCreateUpdateSerializer
@@ -121,27 +358,67 @@ class RecipeViewSet(viewsets.ModelViewSet):
         ] and self.request.user.is_authenticated:
             permission_classes = [IsAuthor]
         else:
-            permission_classes = [IsAuthenticatedOrReadOnly]
+            permission_classes = self.permission_classes
         return [permission() for permission in permission_classes]
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def perform_content_negotiation(self, request, force=False):
+        """Неизвестный ?format= - 404 со списком доступных форматов."""
+        try:
+            return super().perform_content_negotiation(request, force)
+        except Http404:
+            formats = ', '.join(
+                renderer.format for renderer in self.get_renderers()
+            )
+            raise NotFound(
+                f'Формат не поддерживается. Доступные форматы: {formats}.'
+            )
+
+    def handle_exception(self, exc):
+        """
+        Ошибки выгрузки списка покупок отдаются в JSON, а не рендерером
+        выбранного (или первого, если выбор не удался) формата.
+        """
+        response = super().handle_exception(exc)
+        if self.action == 'get':
+            self.request.accepted_renderer = JSONRenderer()
+            self.request.accepted_media_type = JSONRenderer.media_type
+        return response
+
     @action(
         detail=False,
         methods=['get'],
         url_path='download_shopping_cart',
-        permission_classes=[IsAuthenticated]
+        permission_classes=[IsAuthenticated],
+        renderer_classes=[PlainTextRenderer, CSVRenderer, JSONRenderer]
     )
     def get(self, request):
-        carts = ShoppingCart.objects.filter(
-            user=self.request.user
-        ).select_related('recipe')
-        file_buffer = generate_file(carts)
-        response = HttpResponse(file_buffer, content_type='text/plain')
-        response[
-            'Content-Disposition'
-        ] = 'attachment; filename="ingredients.txt"'
+        """
+        Отдаёт список покупок потоком в формате txt, csv или json.
+        Строки читаются из базы порциями через серверный курсор
+        (за PgBouncer, с DB_PGBOUNCER, - одним запросом).
+        Под ASGI поток перебирается в цикле событий, где запросы
+        к базе запрещены, поэтому строки читаются сразу во вьюхе.
+        """
+
+        renderer = request.accepted_renderer
+        groceries = get_shopping_list(request.user).iterator(
+            chunk_size=SHOPPING_LIST_CHUNK_SIZE
+        )
+        if settings.ASGI_MODE:
+            groceries = list(groceries)
+        response = StreamingHttpResponse(
+            measure_export(
+                SHOPPING_LIST_EXPORTERS[renderer.format](groceries),
+                renderer.format
+            ),
+            content_type=f'{renderer.media_type}; charset=utf-8'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="ingredients.{renderer.format}"'
+        )
         return response
 
     @action(
@@ -217,10 +494,30 @@ class GetRecipeShortLink(APIView):
         short_link, created = RecipeShortLink.objects.get_or_create(
             recipe=recipe, defaults={'short_url': generate_short_link()}
         )
-        link = f'https://myuniquehotsname.zapto.org/{short_link.short_url}'
+        link = request.build_absolute_uri(
+            reverse('short_link', args=[short_link.short_url])
+        )
         return Response({'short-link': link}, status=status.HTTP_200_OK)
 
 
+class ShortLinkRedirect(APIView):
+    """Переход по короткой ссылке на страницу рецепта во фронтенде."""
+
+    permission_classes = [AllowAny]
+    authentication_classes = []
+    query_budget = 1
+
+    def get(self, request, short_url):
+        key = short_link_key(short_url)
+        recipe_id = cache.get(key)
+        if recipe_id is None:
+            recipe_id = get_object_or_404(
+                RecipeShortLink, short_url=short_url
+            ).recipe_id
+            cache.set(key, recipe_id, SHORT_LINK_CACHE_TIMEOUT)
+        return HttpResponseRedirect(recipe_page_url(recipe_id))
+
+
 class SubscibeAndDescribe(APIView):
     permission_classes = [IsAuthenticated]
     pagination_class = PageLimitPagination
@@ -232,9 +529,9 @@ class SubscibeAndDescribe(APIView):
             data=data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        this_follow = Follow.objects.get(
-            author=author.id, user=request.user.id
-        )
+        this_follow = get_subscriptions(
+            request.user, get_recipes_limit(request)
+        ).get(author=author)
         outer_serializer = SubscriptionSerializer(
             this_follow, context={'request': request}
         )
@@ -249,3 +546,13 @@ class SubscibeAndDescribe(APIView):
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Http404:
             return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+class Metrics(APIView):
+    """Метрики Prometheus, только для администраторов."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        content, content_type = exposition()
+        return HttpResponse(content, content_type=content_type)
@@ -0,0 +1,38 @@
+from django.db.backends.postgresql import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Бэкенд PostgreSQL с проверкой постоянного подключения, как
+    CONN_HEALTH_CHECKS из Django 4.1. Перед первым запросом к базе
+    в каждом запросе к API подключение проверяется через SELECT 1
+    и при обрыве (перезапуск базы или PgBouncer, таймаут простоя)
+    открывается заново, а не роняет запрос. Запросы к API без
+    обращений к базе проверку не делают.
+    """
+
+    health_check_done = False
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        # Вызывается сигналами request_started и request_finished.
+        self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
+
+    def close_if_health_check_failed(self):
+        if (
+            self.connection is None
+            or self.health_check_done
+            or not self.settings_dict.get('CONN_HEALTH_CHECKS')
+        ):
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
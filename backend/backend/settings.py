@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,6 +51,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Превышение query_budget вьюхи: False - предупреждение в лог,
+# True (для тестов) - исключение QueryBudgetExceeded.
+QUERY_BUDGET_STRICT = strtobool(os.getenv('QUERY_BUDGET_STRICT', 'False'))
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -70,20 +75,54 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
+# Сервер запущен через ASGI (gunicorn с воркерами uvicorn, см.
+# gunicorn.conf.py): горячие GET-запросы обслуживает api.async_views.
+ASGI_MODE = strtobool(os.getenv('ASGI_MODE', 'False'))
+
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Подключение к базе живёт DB_CONN_MAX_AGE секунд (0 - новое на каждый
+# запрос) и проверяется перед первым запросом к базе (backend.postgresql).
+# Каждый воркер gunicorn держит своё подключение. За PgBouncer в режиме
+# transaction нужен DB_PGBOUNCER=True: серверные курсоры не переживают
+# смену подключения между транзакциями.
 DATABASES = {
     'default': {
         # Меняем настройку Django: теперь для работы будет использоваться
         # бэкенд postgresql
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'backend.postgresql',
         'NAME': os.getenv('POSTGRES_DB', 'django'),
         'USER': os.getenv('POSTGRES_USER', 'django'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': strtobool(
+            os.getenv('DB_CONN_HEALTH_CHECKS', 'True')
+        ),
+        'DISABLE_SERVER_SIDE_CURSORS': strtobool(
+            os.getenv('DB_PGBOUNCER', 'False')
+        ),
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Кеш должен быть общим для всех воркеров gunicorn: через него
+# воркеры узнают об изменениях справочника ингредиентов и тегов
+# и делят закешированные ответы API (api.cache). В продакшене:
+# CACHE_BACKEND=django_redis.cache.RedisCache,
+# CACHE_LOCATION=redis://redis:6379/1.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
     }
 }
 
@@ -130,6 +169,9 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'backend_static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = '/var/www/foodgram/media/'
 
+# Число потоков воркера для фоновой нарезки изображений
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -138,6 +180,11 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
 
+# Подсчёт count в постраничной выдаче по умолчанию: exact, cached или
+# estimate (api.paginators). Вьюхи переопределяют его атрибутом
+# count_strategy.
+PAGINATION_COUNT_STRATEGY = os.getenv('PAGINATION_COUNT_STRATEGY', 'exact')
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.TokenAuthentication',
@@ -3,12 +3,20 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from api.async_views import with_fast_paths
+from api.views import ShortLinkRedirect
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/', include('api.urls'))
+    path('api/', include('api.urls')),
+    path('s/<str:short_url>/', ShortLinkRedirect.as_view(),
+         name='short_link')
 ]
 
+if settings.ASGI_MODE:
+    urlpatterns = with_fast_paths(urlpatterns)
+
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL,
                           document_root=settings.MEDIA_ROOT)
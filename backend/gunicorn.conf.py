@@ -0,0 +1,34 @@
+import os
+import shutil
+from distutils.util import strtobool
+
+# Gunicorn читает этот файл из рабочего каталога сам.
+# Каталог метрик Prometheus общий для воркеров (см. api.metrics):
+# при старте мастера он очищается, файлы завершившихся воркеров
+# помечаются, чтобы их gauge не попадали в выдачу.
+
+bind = '0.0.0.0:8000'
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+
+# ASGI_MODE=True: воркеры uvicorn и backend.asgi. Синхронные вьюхи
+# под ASGI выполняются в одном потоке воркера, поэтому число
+# воркеров не уменьшается; выигрыш - в медленных клиентах и горячих
+# GET-запросах из кеша (api.async_views).
+if strtobool(os.getenv('ASGI_MODE', 'False')):
+    wsgi_app = 'backend.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'backend.wsgi:application'
+
+
+def on_starting(server):
+    directory = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -7,6 +7,10 @@ import sys
 def main():
     """Run administrative tasks."""
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    # Каталог метрик Prometheus принадлежит воркерам gunicorn; команды
+    # (например, benchmark в контейнере сервера) не должны дописывать
+    # в него свои запросы, их метрики остаются в памяти процесса.
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -0,0 +1,82 @@
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.dispatch import Signal
+
+from .models import Ingredient, Tag
+
+CATALOG_VERSION_KEY = 'recipes:catalog_version'
+
+# Отправляется при любой смене версии справочника, в том числе после
+# массовой загрузки, которая не шлёт сигналов моделей.
+catalog_changed = Signal()
+
+
+class Catalog:
+    """
+    Справочник ингредиентов и тегов в памяти процесса.
+    Версия справочника хранится в общем кеше и меняется при любом
+    изменении Ingredient или Tag, после чего каждый процесс
+    перечитывает справочник при следующем обращении.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._ingredients = {}
+        self._tags = {}
+
+    def version(self):
+        version = cache.get(CATALOG_VERSION_KEY)
+        if version is None:
+            cache.add(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+            version = cache.get(CATALOG_VERSION_KEY)
+        return version
+
+    def _load(self):
+        version = self.version()
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            self._ingredients = {
+                ingredient.pk: ingredient
+                for ingredient in Ingredient.objects.order_by('name')
+            }
+            self._tags = {tag.pk: tag for tag in Tag.objects.order_by('id')}
+            self._version = version
+
+    def ingredients(self):
+        self._load()
+        return list(self._ingredients.values())
+
+    def tags(self):
+        self._load()
+        return list(self._tags.values())
+
+    def get_ingredient(self, pk):
+        self._load()
+        return self._ingredients.get(pk)
+
+    def get_tag(self, pk):
+        self._load()
+        return self._tags.get(pk)
+
+    def ingredients_by_ids(self, ids):
+        self._load()
+        return {pk: self._ingredients[pk] for pk in ids
+                if pk in self._ingredients}
+
+    def tags_by_ids(self, ids):
+        self._load()
+        return {pk: self._tags[pk] for pk in ids if pk in self._tags}
+
+    @staticmethod
+    def invalidate():
+        cache.set(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+        catalog_changed.send(sender=Catalog)
+
+
+catalog = Catalog()
@@ -3,3 +3,4 @@ MAX_COOCING_TIME = 1000
 MIN_INGREDIENT_AMOUNT = 1
 MAX_INGREDIENT_AMOUNT = 1000
 DEFAULT_INGREDIENT_AMOUNT = 1
+USER_FLAGS_TIMEOUT = 24 * 60 * 60
@@ -0,0 +1,57 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+COUNTERS = (
+    # (модель со счётчиком, поле счётчика, считаемая модель, её поле-ссылка)
+    ('recipes.Recipe', 'favorites_count', 'recipes.Favorite', 'recipe'),
+    ('recipes.Recipe', 'in_carts_count', 'recipes.ShoppingCart', 'recipe'),
+    ('users.User', 'recipes_count', 'recipes.Recipe', 'author'),
+    ('users.User', 'followers_count', 'users.Follow', 'author'),
+)
+
+
+class CountersMixin:
+    """
+    Полный save() существующей записи не пишет поля counter_fields:
+    значения в памяти могут отставать от UPDATE из change_counter,
+    сделанных после загрузки записи.
+    """
+
+    counter_fields = ()
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if update_fields is None and not force_insert and (
+            not self._state.adding
+        ):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+        super().save(force_insert, force_update, using, update_fields)
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно изменяет счётчик на delta, не опуская его ниже нуля."""
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+def recount_counters(apps):
+    """
+    Пересчитывает все счётчики одним UPDATE на каждый счётчик.
+    Принимает реестр приложений, чтобы работать и из миграций.
+    """
+    for owner, field, counted, link in COUNTERS:
+        owner_model = apps.get_model(owner)
+        counted_model = apps.get_model(counted)
+        totals = counted_model.objects.filter(
+            **{link: OuterRef('pk')}
+        ).order_by().values(link).annotate(total=Count('pk')).values('total')
+        owner_model.objects.update(
+            **{field: Coalesce(Subquery(totals), 0)}
+        )
@@ -0,0 +1,71 @@
+import uuid
+from array import array
+
+from django.core.cache import cache
+
+from .constants import USER_FLAGS_TIMEOUT
+
+# Тип элементов массива id: 8-байтовое целое под BigAutoField.
+ID_TYPECODE = 'q'
+
+
+def _keys(model, user_id):
+    prefix = f'recipes:flags:{model._meta.model_name}:{user_id}'
+    return f'{prefix}:version', f'{prefix}:ids'
+
+
+def _load(model, user_id):
+    """
+    Версия и массив id читаются одним запросом к кешу. Массив
+    сохраняется вместе с версией, прочитанной до запроса к базе,
+    поэтому изменение во время загрузки не закрепит старый набор.
+    """
+
+    version_key, ids_key = _keys(model, user_id)
+    cached = cache.get_many([version_key, ids_key])
+    version = cached.get(version_key)
+    if version is None:
+        cache.add(version_key, uuid.uuid4().hex, None)
+        version = cache.get(version_key)
+    stored = cached.get(ids_key)
+    if stored is not None and stored[0] == version:
+        ids = array(ID_TYPECODE)
+        ids.frombytes(stored[1])
+        return set(ids)
+    ids = model.objects.filter(user_id=user_id).values_list(
+        'recipe_id', flat=True
+    )
+    ids = array(ID_TYPECODE, sorted(ids))
+    cache.set(ids_key, (version, ids.tobytes()), USER_FLAGS_TIMEOUT)
+    return set(ids)
+
+
+def recipe_ids(request, model):
+    """
+    Множество id рецептов текущего пользователя в Favorite или
+    ShoppingCart. Загружается не чаще раза за запрос: результат
+    хранится на объекте запроса.
+    """
+
+    if not request.user.is_authenticated:
+        return frozenset()
+    loaded = request.__dict__.setdefault('_recipe_ids', {})
+    if model not in loaded:
+        loaded[model] = _load(model, request.user.pk)
+    return loaded[model]
+
+
+def versions(user_id, models):
+    """
+    Версии наборов пользователя (избранное, корзина, подписки) для
+    валидаторов условных запросов. Отсутствующая версия - None:
+    следующая инвалидация всё равно её сменит.
+    """
+
+    keys = [_keys(model, user_id)[0] for model in models]
+    cached = cache.get_many(keys)
+    return tuple(cached.get(key) for key in keys)
+
+
+def invalidate(model, user_id):
+    cache.set(_keys(model, user_id)[0], uuid.uuid4().hex, None)
@@ -0,0 +1,78 @@
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.catalog import catalog
+from recipes.models import Ingredient
+
+DEFAULT_PATH = settings.BASE_DIR.parent / 'data' / 'ingredients.csv'
+BATCH_SIZE = 1000
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8', newline='') as file:
+        for row in csv.reader(file):
+            if row:
+                yield row[0], row[1]
+
+
+def read_json(path):
+    with open(path, encoding='utf-8') as file:
+        for item in json.load(file):
+            yield item['name'], item['measurement_unit']
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из data/ingredients.csv или .json. '
+        'Уже существующие ингредиенты пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', type=Path, default=DEFAULT_PATH,
+            help='Путь к файлу .csv или .json'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help='Число строк в одном INSERT'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        reader = READERS.get(path.suffix.lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json.')
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден.')
+        started = time.monotonic()
+        count_before = Ingredient.objects.count()
+        rows = (
+            Ingredient(name=name.strip(), measurement_unit=unit.strip())
+            for name, unit in reader(path)
+        )
+        total = 0
+        while True:
+            batch = list(islice(rows, options['batch_size']))
+            if not batch:
+                break
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+            total += len(batch)
+        catalog.invalidate()
+        elapsed = time.monotonic() - started
+        created = Ingredient.objects.count() - count_before
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {total}, добавлено: {created}, '
+            f'{elapsed:.2f} с ({total / max(elapsed, 1e-6):.0f} строк/с).'
+        ))
@@ -0,0 +1,17 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.counters import recount_counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счётчики избранного, списков покупок, '
+        'рецептов и подписчиков.'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            recount_counters(apps)
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны.'))
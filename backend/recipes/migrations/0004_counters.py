@@ -0,0 +1,30 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:21
+
+from django.db import migrations, models
+
+
+def recount(apps, schema_editor):
+    from recipes.counters import recount_counters
+    recount_counters(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_auto_20241031_1113'),
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='в избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='в списках покупок'),
+        ),
+        migrations.RunPython(recount, migrations.RunPython.noop),
+    ]
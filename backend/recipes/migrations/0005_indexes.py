@@ -0,0 +1,48 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:22
+
+from django.db import migrations, models
+from django.db.models import Min
+
+UNIQUE_FIELDS = (
+    ('Favorite', ('user', 'recipe')),
+    ('ShoppingCart', ('user', 'recipe')),
+    ('IngredientRecipe', ('recipe', 'ingredient')),
+)
+
+
+def remove_duplicates(apps, schema_editor):
+    from recipes.counters import recount_counters
+    for model_name, fields in UNIQUE_FIELDS:
+        model = apps.get_model('recipes', model_name)
+        first_ids = model.objects.values(*fields).annotate(
+            first_id=Min('id')
+        ).values('first_id')
+        model.objects.exclude(id__in=first_ids).delete()
+    recount_counters(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-id'], name='recipe_author_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favorite'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_ingredient_recipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_shoppingcart'),
+        ),
+    ]
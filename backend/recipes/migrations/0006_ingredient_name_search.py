@@ -0,0 +1,38 @@
+from django.db import migrations
+
+CREATE_INDEXES = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ingredient_name_prefix_idx '
+    'ON recipes_ingredient (LOWER(name) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS ingredient_name_trgm_idx '
+    'ON recipes_ingredient USING gin (LOWER(name) gin_trgm_ops)',
+)
+DROP_INDEXES = (
+    'DROP INDEX IF EXISTS ingredient_name_prefix_idx',
+    'DROP INDEX IF EXISTS ingredient_name_trgm_idx',
+)
+
+
+def run_on_postgresql(statements):
+    """Индексы поиска нужны только PostgreSQL, на SQLite их нет."""
+
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_on_postgresql(CREATE_INDEXES),
+            run_on_postgresql(DROP_INDEXES)
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:29
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_ingredient_name_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=recipes.storage.ContentHashStorage(), upload_to='api/images/', verbose_name='картинка'),
+        ),
+    ]
@@ -3,6 +3,7 @@ from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 
 from users.constants import EMAIL_LENGTH, NAME_LENGTH
+from users.models import Follow
 
 from .constants import (
     DEFAULT_INGREDIENT_AMOUNT,
@@ -11,6 +12,8 @@ from .constants import (
     MIN_COOCING_TIME,
     MIN_INGREDIENT_AMOUNT
 )
+from .counters import CountersMixin
+from .storage import image_storage
 
 
 User = get_user_model()
@@ -26,6 +29,10 @@ class Tag(models.Model):
         unique=True,
         verbose_name='слаг'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='изменён'
+    )
 
     class Meta:
         verbose_name = 'тег'
@@ -41,6 +48,10 @@ class Ingredient(models.Model):
         max_length=NAME_LENGTH,
         verbose_name='единица измерения'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='изменён'
+    )
 
     class Meta:
         constraints = [
@@ -52,7 +63,38 @@ class Ingredient(models.Model):
         verbose_name_plural = 'Ингредиенты'
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+
+    def with_related(self, user):
+        """
+        План загрузки рецептов для выдачи: автор, теги и ингредиенты
+        подгружаются заранее, подписка на автора аннотируется.
+        """
+        queryset = self.select_related('author').prefetch_related(
+            models.Prefetch('tags', queryset=Tag.objects.all()),
+            models.Prefetch(
+                'ingredientrecipe_set',
+                queryset=IngredientRecipe.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
+        if not user.is_authenticated:
+            return queryset.annotate(
+                author_is_subscribed=models.Value(
+                    False, output_field=models.BooleanField()
+                )
+            )
+        return queryset.annotate(
+            author_is_subscribed=models.Exists(
+                Follow.objects.filter(
+                    user=user, author=models.OuterRef('author')
+                )
+            )
+        )
+
+
+class Recipe(CountersMixin, models.Model):
     author = models.ForeignKey(
         User,
         related_name='recipes',
@@ -65,6 +107,7 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='api/images/',
+        storage=image_storage,
         verbose_name='картинка'
     )
     text = models.TextField(verbose_name='текст')
@@ -90,8 +133,30 @@ class Recipe(models.Model):
                          f'не должно быть меньше {MIN_COOCING_TIME}.')
             )
         ])
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='в избранном'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='в списках покупок'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='изменён'
+    )
+
+    objects = RecipeQuerySet.as_manager()
+    counter_fields = ('favorites_count', 'in_carts_count')
 
     class Meta:
+        indexes = [
+            models.Index(
+                fields=['author', '-id'], name='recipe_author_id_idx'
+            )
+        ]
         verbose_name = 'рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -118,6 +183,12 @@ class IngredientRecipe(models.Model):
             )])
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'ingredient'],
+                name='unique_ingredient_recipe'
+            )
+        ]
         verbose_name = 'ингредиент в рецепте'
         verbose_name_plural = 'ингдиенты в рецепте'
 
@@ -138,6 +209,11 @@ class CartsAndLikes(models.Model):
 
     class Meta:
         abstract = True
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'], name='unique_%(class)s'
+            )
+        ]
 
 
 class ShoppingCart(CartsAndLikes):
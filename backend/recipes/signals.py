@@ -0,0 +1,56 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from users.models import Follow, User
+
+from .catalog import catalog
+from .counters import change_counter
+from .flags import invalidate
+from .models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+
+COUNTED_MODELS = {
+    # считаемая модель: (модель со счётчиком, поле-ссылка, поле счётчика)
+    Favorite: (Recipe, 'recipe_id', 'favorites_count'),
+    ShoppingCart: (Recipe, 'recipe_id', 'in_carts_count'),
+    Recipe: (User, 'author_id', 'recipes_count'),
+    Follow: (User, 'author_id', 'followers_count'),
+}
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Follow)
+def increase_counter(sender, instance, created, raw=False, **kwargs):
+    if not created or raw:
+        return
+    model, link, field = COUNTED_MODELS[sender]
+    change_counter(model, getattr(instance, link), field, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Follow)
+def decrease_counter(sender, instance, **kwargs):
+    model, link, field = COUNTED_MODELS[sender]
+    change_counter(model, getattr(instance, link), field, -1)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_catalog(sender, **kwargs):
+    transaction.on_commit(catalog.invalidate)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_flags(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate(sender, instance.user_id))
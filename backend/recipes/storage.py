@@ -0,0 +1,49 @@
+import hashlib
+import os
+
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentHashStorage(FileSystemStorage):
+    """
+    Хранилище картинок с адресацией по содержимому: файл сохраняется
+    под именем из SHA-256 своих байт, поэтому одинаковые картинки
+    лежат на диске один раз. Удаляет файлы без ссылок только команда
+    collect_orphan_images, и только старше --min-age: при повторной
+    загрузке уже лежащего файла его время изменения обновляется.
+    """
+
+    def _hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(
+            os.path.dirname(name), digest[:2], digest + extension
+        )
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self._hashed_name(name or content.name, content)
+        if self.exists(name):
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                # Файл успел удалить collect_orphan_images.
+                pass
+        return super().save(name, content, max_length=max_length)
+
+    def save_derived(self, name, content):
+        """Сохраняет производный файл (уменьшенную копию) под его именем."""
+        return super().save(name, content)
+
+
+image_storage = ContentHashStorage()
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:29
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, storage=recipes.storage.ContentHashStorage(), upload_to='api/images/'),
+        ),
+    ]
@@ -2,12 +2,15 @@ from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.db import models
 
+from recipes.counters import CountersMixin
+from recipes.storage import image_storage
+
 from .constants import EMAIL_LENGTH, NAME_LENGTH
 
 from .validators import username_validators
 
 
-class User(AbstractUser):
+class User(CountersMixin, AbstractUser):
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = (
@@ -15,6 +18,7 @@ class User(AbstractUser):
         'first_name',
         'last_name',
     )
+    counter_fields = ('recipes_count', 'followers_count')
 
     username = models.CharField(
         max_length=NAME_LENGTH,
@@ -46,9 +50,24 @@ class User(AbstractUser):
     )
     avatar = models.ImageField(
         upload_to='api/images/',
+        storage=image_storage,
         null=True,
         blank=True
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписчиков'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Изменён'
+    )
 
     class Meta:
         ordering = ('username',)